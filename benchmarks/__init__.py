@@ -0,0 +1 @@
+# benchmarks: 以合成市場資料計時匯入、載入、指標與排序等步驟，執行方式見 benchmarks/run.py
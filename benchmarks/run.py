@@ -0,0 +1,303 @@
+# benchmarks/run.py
+"""
+效能基準測試：以 synthetic.generate_market 產生的合成資料，計時資料匯入、load_data、
+各指標函式、期間篩選、多公司增長率、排序與 CSVCombiner 合併清理等步驟。
+
+    python -m benchmarks.run --companies 1000 --years 10 --repeat 5
+    python -m benchmarks.run --baseline benchmarks/results/benchmark_20250101_000000.json
+
+每個步驟執行 --repeat 次 (另先執行 --warmup 次不計時)，記錄每次的秒數與最小值 / 中位數 / 平均；
+結果以 JSON 寫入 benchmarks/results/ (或 --output)，--baseline 指定舊結果時列出中位數的前後比較。
+"""
+import argparse
+import contextlib
+import importlib
+import io
+import json
+import os
+import platform
+import shutil
+import statistics
+import subprocess
+import sys
+import tempfile
+import time
+from datetime import datetime
+
+import numpy as np
+import pandas as pd
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+RESULTS_DIR = os.path.join(ROOT, "benchmarks", "results")
+# 專案根目錄與 data_pipeline 的模組以頂層名稱匯入 (與前端及匯入腳本相同)
+for path in (ROOT, os.path.join(ROOT, "data_pipeline")):
+    if path not in sys.path:
+        sys.path.insert(0, path)
+# 計時的是程式本身，不含 instrumentation 的紀錄成本 (也不寫入效能紀錄檔)
+os.environ.setdefault("FINANCIAL_INSTRUMENTATION", "0")
+
+from benchmarks.synthetic import generate_market, write_processed_csvs, write_raw_statements
+
+
+class Benchmark:
+    """依序執行並記錄各步驟的耗時；被計時的函式輸出 (print) 一律隱藏"""
+    def __init__(self, repeat=5, warmup=1):
+        self.repeat = repeat
+        self.warmup = warmup
+        self.results = []
+
+    def run(self, group, name, func, rows=None, setup=None):
+        """
+        計時 func()：每次執行前呼叫 setup() (不計時，例如清除快取或重建資料庫)。
+        rows 為該步驟處理的資料列數，記錄在結果中方便換算每列成本。
+        """
+        seconds = []
+        for i in range(self.warmup + self.repeat):
+            if setup is not None:
+                with contextlib.redirect_stdout(io.StringIO()):
+                    setup()
+            with contextlib.redirect_stdout(io.StringIO()):
+                start = time.perf_counter()
+                func()
+                elapsed = time.perf_counter() - start
+            if i >= self.warmup:
+                seconds.append(elapsed)
+        result = {
+            "group": group,
+            "name": name,
+            "rows": rows,
+            "seconds": seconds,
+            "min": min(seconds),
+            "median": statistics.median(seconds),
+            "mean": statistics.fmean(seconds),
+        }
+        self.results.append(result)
+        print(f"⏱ {group:<10} {name:<40} {result['median'] * 1000:10.2f} ms")
+        return result
+
+    def skip(self, group, reason):
+        print(f"⚠️ 略過 {group}：{reason}")
+
+
+def _git_commit():
+    try:
+        return subprocess.run(["git", "rev-parse", "--short", "HEAD"], cwd=ROOT,
+                              capture_output=True, text=True, check=True).stdout.strip()
+    except (OSError, subprocess.CalledProcessError):
+        return None
+
+
+def bench_pipeline(bench, workdir, monthly, quarterly):
+    """CSV 匯入、指標表全部重算與最新一期的增量重算，回傳建好的資料庫路徑"""
+    from insert_data_to_DB import DatabaseManager
+
+    monthly_dir, quarterly_dir = write_processed_csvs(monthly, quarterly, workdir)
+    db_path = os.path.join(workdir, "financial_data.db")
+    state = {}
+
+    def fresh_database():
+        if "db" in state:
+            state.pop("db").close_connection()
+        for suffix in ("", "-wal", "-shm"):
+            if os.path.exists(db_path + suffix):
+                os.remove(db_path + suffix)
+        state["db"] = DatabaseManager(db_path)
+        state["db"].migrate()
+
+    def ingest():
+        state["monthly_periods"] = state["db"].insert_data_from_csv(monthly_dir, "monthly_revenue")
+        state["quarterly_periods"] = state["db"].insert_data_from_csv(quarterly_dir, "quarterly_report")
+
+    bench.run("pipeline", "insert_data_from_csv", ingest, len(monthly) + len(quarterly), setup=fresh_database)
+    db = state["db"]
+    bench.run("pipeline", "refresh_metrics (全部)", db.refresh_metrics, len(monthly) + len(quarterly))
+    latest = {"monthly_revenue": state["monthly_periods"][-1:], "quarterly_report": state["quarterly_periods"][-1:]}
+    bench.run("pipeline", "refresh_metrics (增量，最新一期)", lambda: db.refresh_metrics(latest))
+    db.close_connection()
+    return db_path
+
+
+def bench_combiners(bench, workdir, n_companies):
+    """資產負債表與綜合損益表 CSVCombiner 的讀檔、合併清理與欄位轉換"""
+    try:
+        balance_sheet = importlib.import_module("get_balance_sheet")
+        income = importlib.import_module("get_consolidated_income")
+    except ImportError as e:
+        bench.skip("combiner", f"無法匯入爬蟲模組 ({e})")
+        return
+    key_columns = ["公司代號", "公司名稱"]
+
+    folder = os.path.join(workdir, "raw_balance_sheet")
+    write_raw_statements(folder, [c for c in balance_sheet.column_mapping if c not in key_columns], n_companies)
+    combiner = balance_sheet.CSVCombiner(folder, key_columns, os.path.join(workdir, "balance_sheet.csv"), "113", "1")
+    bench.run("combiner", "資產負債表 load_csv_files", combiner.load_csv_files, n_companies,
+              setup=lambda: combiner.dataframes.clear())
+    bench.run("combiner", "資產負債表 merge_data", combiner.merge_data, n_companies)
+
+    folder = os.path.join(workdir, "raw_income")
+    sources = sorted({c for candidates in income.CSVCombiner(folder, key_columns, "", "113", "1").mapping.values()
+                      for c in candidates if c not in key_columns})
+    write_raw_statements(folder, sources, n_companies)
+    combiner = income.CSVCombiner(folder, key_columns, os.path.join(workdir, "income.csv"), "113", "1")
+
+    def reset_income():
+        combiner.dfs.clear()
+        combiner.all_columns = set(key_columns)
+
+    bench.run("combiner", "綜合損益表 load_csv_files", combiner.load_csv_files, n_companies, setup=reset_income)
+    state = {}
+
+    def merge():
+        state["merged"] = combiner.merge_data()
+
+    bench.run("combiner", "綜合損益表 merge_data", merge, n_companies)
+    bench.run("combiner", "綜合損益表 transform_columns",
+              lambda: combiner.transform_columns(state["merged"], "113", "1"), n_companies)
+
+
+def bench_frontend(bench, workdir, seed):
+    """load_data 與前端各頁使用的計算 (須在設定 FINANCIAL_DB_PATH 之後才匯入前端模組)"""
+    import data_access
+    from metrics import (calculate_monthly_metrics, calculate_monthly_qoq, calculate_quarterly_metrics,
+                         add_peer_ranks, latest_industries, industry_cube, metric_frame, period_index)
+    from periods import PeriodView
+    from company_store import CompanyStore
+    from companies import CompanyDirectory
+    from multi_company_analysis import compute_growth, company_series
+    from overall_sorting import compute_sort_values
+    from screener import Screener
+    from scoring import DEFAULT_WEIGHTS, composite_scores
+
+    snapshot_dir = data_access.SNAPSHOT_DIR
+
+    def cold_cache():
+        data_access._load_table.clear()
+        shutil.rmtree(snapshot_dir, ignore_errors=True)
+
+    bench.run("load", "load_data (SQLite，重建快照)", data_access.load_data, setup=cold_cache)
+    bench.run("load", "load_data (Parquet 快照)", data_access.load_data, setup=data_access._load_table.clear)
+    monthly, quarterly = data_access.load_data()
+    raw_monthly = monthly[["年", "月", "公司代號", "公司名稱", "產業別", "營業收入-當月營收", "市場別"]]
+    raw_quarterly = quarterly.drop(columns=[c for c in quarterly.columns if c.endswith("百分位")])
+    industries = latest_industries(raw_monthly)
+
+    bench.run("metrics", "calculate_monthly_metrics", lambda: calculate_monthly_metrics(raw_monthly), len(monthly))
+    bench.run("metrics", "calculate_monthly_qoq", lambda: calculate_monthly_qoq(raw_monthly), len(monthly))
+    bench.run("metrics", "calculate_quarterly_metrics", lambda: calculate_quarterly_metrics(raw_quarterly), len(quarterly))
+    bench.run("metrics", "add_peer_ranks (月)", lambda: add_peer_ranks(monthly, "月"), len(monthly))
+    bench.run("metrics", "add_peer_ranks (季)", lambda: add_peer_ranks(quarterly, "季", industries), len(quarterly))
+    frame = metric_frame(raw_monthly, "月")
+    bench.run("metrics", "industry_cube (月)", lambda: industry_cube(frame, "月"), len(frame))
+
+    # 期間篩選：隨機的起訖範圍與單一公司取用
+    rng = np.random.default_rng(seed)
+    state = {}
+
+    def build_view():
+        state["view"] = PeriodView(monthly, "月")
+
+    bench.run("filters", "PeriodView 建立", build_view, len(monthly))
+    view = state["view"]
+    ranges = np.sort(rng.choice(view.periods, (100, 2)), axis=1)
+    bench.run("filters", "PeriodView.slice ×100", lambda: [view.slice(lo, hi) for lo, hi in ranges], len(monthly))
+    keys = period_index(monthly["年"], monthly["月"], "月")
+    bench.run("filters", "布林遮罩期間篩選 ×100 (對照)",
+              lambda: [monthly[(keys >= lo) & (keys <= hi)] for lo, hi in ranges], len(monthly))
+    store = CompanyStore(monthly, "月")
+    codes = rng.choice(store.codes, min(100, len(store.codes)), replace=False)
+    bench.run("filters", "CompanyStore.company ×100", lambda: [store.company(code) for code in codes], len(monthly))
+
+    # 多公司增長率與走勢
+    directory = CompanyDirectory(data_access.load_companies())
+    start, end = int(view.periods[0]), int(view.periods[-1])
+    all_codes = directory.codes
+    bench.run("growth", "compute_growth (全部公司)",
+              lambda: compute_growth(view, all_codes, directory, start, end, "營業收入-當月營收"), len(all_codes))
+    few_codes = all_codes[:50]
+    bench.run("growth", "company_series (50 家)",
+              lambda: company_series(view, few_codes, start, end, "營業收入-當月營收"), len(few_codes))
+
+    # 排序、Top-K 與綜合分數
+    bench.run("sort", "compute_sort_values (YOY)",
+              lambda: compute_sort_values(view.df, "營業收入-當月營收", "YOY", True), len(monthly))
+    values = compute_sort_values(view.df, "營業收入-當月營收", "YOY", True)
+    lo, hi = view.bounds(start, end)
+    bench.run("sort", "全範圍排序 (argsort)", lambda: np.argsort(-values[lo:hi], kind="stable"), hi - lo)
+    screener = Screener(view)
+    bench.run("sort", "Screener.top_k (k=50)", lambda: screener.top_k("YoY", end, 50), len(monthly))
+    weights = DEFAULT_WEIGHTS["monthly_revenue"]
+    bench.run("sort", "composite_scores (月)", lambda: composite_scores(view.df, "月", weights), len(monthly))
+
+
+def compare(results, baseline_path):
+    """列出與舊結果 (baseline_path) 相同步驟的中位數與倍數"""
+    with open(baseline_path, encoding="utf-8") as f:
+        baseline = {(r["group"], r["name"]): r for r in json.load(f)["results"]}
+    print(f"\n與 {baseline_path} 比較 (中位數)：")
+    for result in results:
+        old = baseline.get((result["group"], result["name"]))
+        if old is None:
+            continue
+        ratio = result["median"] / old["median"] if old["median"] else float("nan")
+        print(f"  {result['group']:<10} {result['name']:<40} "
+              f"{old['median'] * 1000:10.2f} ms → {result['median'] * 1000:10.2f} ms  ×{ratio:.2f}")
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="以合成資料執行效能基準測試")
+    parser.add_argument("--companies", type=int, default=1000, help="公司家數")
+    parser.add_argument("--years", type=int, default=10, help="資料年數")
+    parser.add_argument("--gap-rate", type=float, default=0.03, help="隨機缺漏的資料列比例")
+    parser.add_argument("--duplicate-rate", type=float, default=0.01, help="重複資料列比例")
+    parser.add_argument("--repeat", type=int, default=5, help="每個步驟計時的次數")
+    parser.add_argument("--warmup", type=int, default=1, help="計時前先執行的次數")
+    parser.add_argument("--seed", type=int, default=0)
+    parser.add_argument("--output", help="結果 JSON 路徑 (預設 benchmarks/results/benchmark_<時間>.json)")
+    parser.add_argument("--baseline", help="要比較的舊結果 JSON")
+    parser.add_argument("--keep", action="store_true", help="保留產生的資料庫與 CSV (預設結束後刪除)")
+    args = parser.parse_args(argv)
+
+    workdir = tempfile.mkdtemp(prefix="financial_benchmark_")
+    bench = Benchmark(args.repeat, args.warmup)
+    config = {key: getattr(args, key) for key in ("companies", "years", "gap_rate", "duplicate_rate",
+                                                  "repeat", "warmup", "seed")}
+    try:
+        start = time.perf_counter()
+        monthly, quarterly = generate_market(args.companies, args.years, gap_rate=args.gap_rate,
+                                             duplicate_rate=args.duplicate_rate, seed=args.seed)
+        print(f"✅ 已產生合成資料：月營收 {len(monthly)} 列、季報 {len(quarterly)} 列 "
+              f"({time.perf_counter() - start:.1f} 秒)，工作目錄 {workdir}")
+        config.update(monthly_rows=len(monthly), quarterly_rows=len(quarterly))
+
+        db_path = bench_pipeline(bench, workdir, monthly, quarterly)
+        bench_combiners(bench, workdir, args.companies)
+        # 前端模組在匯入時讀取資料庫路徑，須先指向合成資料庫
+        os.environ["FINANCIAL_DB_PATH"] = db_path
+        os.environ["FINANCIAL_SNAPSHOT_DIR"] = os.path.join(workdir, "snapshot")
+        bench_frontend(bench, workdir, args.seed)
+    finally:
+        if not args.keep:
+            shutil.rmtree(workdir, ignore_errors=True)
+
+    report = {
+        "timestamp": datetime.now().isoformat(timespec="seconds"),
+        "git_commit": _git_commit(),
+        "python": platform.python_version(),
+        "numpy": np.__version__,
+        "pandas": pd.__version__,
+        "platform": platform.platform(),
+        "config": config,
+        "results": bench.results,
+    }
+    output = args.output or os.path.join(RESULTS_DIR, f"benchmark_{datetime.now():%Y%m%d_%H%M%S}.json")
+    os.makedirs(os.path.dirname(os.path.abspath(output)), exist_ok=True)
+    with open(output, "w", encoding="utf-8") as f:
+        json.dump(report, f, ensure_ascii=False, indent=2)
+    print(f"📂 已儲存結果至: {output}")
+    if args.baseline:
+        compare(bench.results, args.baseline)
+    return report
+
+
+if __name__ == "__main__":
+    main()
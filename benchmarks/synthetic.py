@@ -0,0 +1,154 @@
+# benchmarks/synthetic.py
+import os
+import numpy as np
+import pandas as pd
+
+# 合成資料的產業別與市場別
+INDUSTRIES = ("半導體業", "電子零組件業", "電腦及週邊設備業", "光電業", "通信網路業", "金融保險業",
+              "航運業", "食品工業", "塑膠工業", "鋼鐵工業", "生技醫療業", "建材營造業")
+MARKETS = ("sii", "otc")
+# 季報金額欄位相對於「資產總計(額)」的比例範圍
+_BALANCE_RATIOS = {
+    "負債總計(額)": (0.2, 0.8),
+    "股本": (0.05, 0.2),
+    "資本公積": (0.01, 0.1),
+    "保留盈餘(或累積虧損)": (-0.05, 0.3),
+    "其他權益": (-0.02, 0.02),
+    "流動資產": (0.2, 0.6),
+    "流動負債": (0.1, 0.4),
+    "非流動負債": (0.05, 0.3),
+}
+
+
+def _companies(n_companies, rng):
+    """公司代號、名稱、產業別、市場別與營收規模"""
+    codes = 1101 + np.arange(n_companies) * 3
+    return pd.DataFrame({
+        "公司代號": codes,
+        "公司名稱": [f"合成{code}" for code in codes],
+        "產業別": rng.choice(INDUSTRIES, n_companies),
+        "市場別": rng.choice(MARKETS, n_companies, p=[0.55, 0.45]),
+        # 月營收規模 (千元) 呈對數常態分布，約 1 百萬到 1 百億
+        "規模": np.exp(rng.normal(np.log(3e5), 1.5, n_companies)),
+        # 年成長率與上市期間 (部分公司較晚才有資料)
+        "成長率": rng.normal(0.05, 0.15, n_companies),
+        "起始期": np.where(rng.random(n_companies) < 0.1, rng.integers(0, 60, n_companies), 0),
+    })
+
+
+def _drop_gaps_and_duplicate(df, gap_rate, duplicate_rate, rng):
+    """隨機刪除 gap_rate 比例的資料列 (缺漏月份)，再重複 duplicate_rate 比例的資料列 (重複公告)"""
+    df = df[rng.random(len(df)) >= gap_rate]
+    duplicates = df[rng.random(len(df)) < duplicate_rate]
+    return pd.concat([df, duplicates], ignore_index=True)
+
+
+def generate_market(n_companies=1000, n_years=10, start_year=105, gap_rate=0.03, duplicate_rate=0.01, seed=0):
+    """
+    產生合成的月營收與季報資料 (欄位與 data_pipeline/insert_data_to_DB.py 的 TABLE_SCHEMAS 相同)：
+      - n_companies 家公司 × n_years 年，自民國 start_year 年起
+      - gap_rate：隨機缺漏的資料列比例；部分公司另有較晚的起始期間
+      - duplicate_rate：重複出現的資料列比例 (模擬重複公告，同一主鍵出現兩次)
+    回傳 (monthly_df, quarterly_df)。
+    """
+    rng = np.random.default_rng(seed)
+    companies = _companies(n_companies, rng)
+    n_months = n_years * 12
+
+    # 月營收：規模 × 年成長趨勢 × 季節性 × 雜訊
+    month_pos = np.tile(np.arange(n_months), n_companies)
+    company_pos = np.repeat(np.arange(n_companies), n_months)
+    trend = (1 + companies["成長率"].to_numpy()[company_pos]) ** (month_pos / 12)
+    season = 1 + 0.1 * np.sin(2 * np.pi * (month_pos % 12) / 12)
+    revenue = companies["規模"].to_numpy()[company_pos] * trend * season * rng.lognormal(0, 0.15, len(month_pos))
+    monthly = pd.DataFrame({
+        "年": start_year + month_pos // 12,
+        "月": month_pos % 12 + 1,
+        "公司代號": companies["公司代號"].to_numpy()[company_pos],
+        "公司名稱": companies["公司名稱"].to_numpy()[company_pos],
+        "產業別": companies["產業別"].to_numpy()[company_pos],
+        "營業收入-當月營收": revenue.round().astype("int64"),
+        "備註": "-",
+        "市場別": companies["市場別"].to_numpy()[company_pos],
+    })
+    monthly = monthly[month_pos >= companies["起始期"].to_numpy()[company_pos]]
+    monthly = _drop_gaps_and_duplicate(monthly, gap_rate, duplicate_rate, rng)
+
+    # 季報：資產規模約為月營收的 20 倍，其餘金額依 _BALANCE_RATIOS 取比例
+    n_quarters = n_years * 4
+    quarter_pos = np.tile(np.arange(n_quarters), n_companies)
+    company_pos = np.repeat(np.arange(n_companies), n_quarters)
+    n_rows = len(quarter_pos)
+    trend = (1 + companies["成長率"].to_numpy()[company_pos]) ** (quarter_pos / 4)
+    quarterly_revenue = companies["規模"].to_numpy()[company_pos] * 3 * trend * rng.lognormal(0, 0.1, n_rows)
+    assets = quarterly_revenue * rng.uniform(4, 10, n_rows)
+    quarterly = pd.DataFrame({
+        "年": start_year + quarter_pos // 4,
+        "季": quarter_pos % 4 + 1,
+        "公司代號": companies["公司代號"].to_numpy()[company_pos],
+        "公司名稱": companies["公司名稱"].to_numpy()[company_pos],
+        "資產總計(額)": assets,
+    })
+    for col, (lo, hi) in _BALANCE_RATIOS.items():
+        quarterly[col] = assets * rng.uniform(lo, hi, n_rows)
+    quarterly["非流動資產"] = assets - quarterly["流動資產"]
+    quarterly["權益總計(額)"] = assets - quarterly["負債總計(額)"]
+    quarterly["歸屬於母公司業主之權益(合計)"] = quarterly["權益總計(額)"] * rng.uniform(0.9, 1.0, n_rows)
+    quarterly["母公司暨子公司持有之母公司庫藏股股數（單位：股）"] = 0
+    quarterly["營業收入"] = quarterly_revenue
+    quarterly["營業成本"] = quarterly_revenue * rng.uniform(0.5, 0.95, n_rows)
+    quarterly["營業毛利（毛損）"] = quarterly_revenue - quarterly["營業成本"]
+    quarterly["營業費用"] = quarterly_revenue * rng.uniform(0.02, 0.15, n_rows)
+    quarterly["稅前淨利（淨損）"] = quarterly["營業毛利（毛損）"] - quarterly["營業費用"]
+    quarterly["所得稅費用（利益）"] = quarterly["稅前淨利（淨損）"] * 0.2
+    quarterly["綜合損益總額歸屬於母公司業主"] = quarterly["稅前淨利（淨損）"] * 0.8
+    shares = quarterly["股本"] / 10
+    quarterly["基本每股盈餘（元）"] = (quarterly["綜合損益總額歸屬於母公司業主"] / shares).round(2)
+    quarterly["每股參考淨值"] = (quarterly["權益總計(額)"] / shares).round(2)
+    amount_cols = [col for col in quarterly.columns
+                   if col not in ("年", "季", "公司代號", "公司名稱", "基本每股盈餘（元）", "每股參考淨值")]
+    quarterly[amount_cols] = quarterly[amount_cols].round().astype("int64")
+    quarterly = quarterly[quarter_pos >= companies["起始期"].to_numpy()[company_pos] // 3]
+    quarterly = _drop_gaps_and_duplicate(quarterly, gap_rate, duplicate_rate, rng)
+    return monthly.reset_index(drop=True), quarterly.reset_index(drop=True)
+
+
+def write_processed_csvs(monthly, quarterly, folder):
+    """
+    依資料處理流程 (data_pipeline) 的檔名慣例寫出處理後的 CSV，回傳 (月營收資料夾, 季報資料夾)：
+      - monthly_revenue_processed/monthly_revenue_{市場別}_{年}_{月}.csv (市場別由檔名取得，不寫入欄位)
+      - quarterly_report_processed/final_merged_{年}_{季}.csv (與 data_update.py 的輸出相同)
+    """
+    monthly_dir = os.path.join(folder, "monthly_revenue_processed")
+    quarterly_dir = os.path.join(folder, "quarterly_report_processed")
+    os.makedirs(monthly_dir, exist_ok=True)
+    os.makedirs(quarterly_dir, exist_ok=True)
+    for (market, year, month), group in monthly.groupby(["市場別", "年", "月"]):
+        path = os.path.join(monthly_dir, f"monthly_revenue_{market}_{year}_{month}.csv")
+        group.drop(columns="市場別").to_csv(path, index=False, encoding="utf-8-sig")
+    for (year, season), group in quarterly.groupby(["年", "季"]):
+        path = os.path.join(quarterly_dir, f"final_merged_{year}_{season}.csv")
+        group.to_csv(path, index=False, encoding="utf-8-sig")
+    return monthly_dir, quarterly_dir
+
+
+def write_raw_statements(folder, value_columns, n_companies=1000, n_files=4, text_rate=0.02, seed=0):
+    """
+    產生公開資訊觀測站格式的原始報表 CSV (供 CSVCombiner 合併與清理)：
+      - 共 n_files 個檔案 (模擬各產業別的報表)，公司平均分配，欄位為 公司代號、公司名稱 與 value_columns
+      - 數值含千分位逗號，text_rate 比例的儲存格為 "--" 等非數字內容
+    檔名以 _0.csv、_2.csv… 結尾 (資產負債表的 CSVCombiner 會略過 _1.csv)。回傳檔案路徑清單。
+    """
+    rng = np.random.default_rng(seed)
+    os.makedirs(folder, exist_ok=True)
+    codes = 1101 + np.arange(n_companies) * 3
+    paths = []
+    for i, chunk in enumerate(np.array_split(codes, n_files)):
+        values = rng.normal(0, 1e6, (len(chunk), len(value_columns))).round()
+        cells = pd.DataFrame(values, columns=list(value_columns)).map(lambda x: f"{x:,.0f}")
+        cells = cells.mask(rng.random(cells.shape) < text_rate, "--")
+        df = pd.concat([pd.DataFrame({"公司代號": chunk, "公司名稱": [f"合成{code}" for code in chunk]}), cells], axis=1)
+        path = os.path.join(folder, f"raw_statement_{i * 2}.csv")
+        df.to_csv(path, index=False, encoding="utf-8")
+        paths.append(path)
+    return paths
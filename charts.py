@@ -0,0 +1,111 @@
+# charts.py
+import numpy as np
+import plotly.graph_objects as go
+from periods import period_labels
+from instrumentation import instrument
+
+# 整張圖的資料點超過此數量時改用 WebGL (Scattergl) 繪製
+WEBGL_THRESHOLD = 1000
+# 整張圖傳給瀏覽器的資料點上限，超過時各序列以 LTTB 降採樣平均分配
+MAX_POINTS = 20000
+# 每條序列至少保留的點數 (序列很多時避免被降到只剩端點)
+MIN_POINTS_PER_SERIES = 24
+# x 軸最多顯示的刻度數
+MAX_TICKS = 12
+
+
+def lttb(x, y, n_out):
+    """
+    Largest-Triangle-Three-Buckets 降採樣，回傳要保留的列位置 (遞增)。
+    頭尾兩點一定保留，中間每個區間保留與前一個保留點、下一區間平均點圍成面積最大的點，
+    能以少量點保留折線的峰谷形狀。x 須為遞增數值，且不含 NaN。
+    """
+    n = len(x)
+    if n_out >= n or n_out < 3:
+        return np.arange(n)
+    x = np.asarray(x, dtype="float64")
+    y = np.asarray(y, dtype="float64")
+    edges = np.linspace(1, n - 1, n_out - 1).astype("int64")
+    keep = np.empty(n_out, dtype="int64")
+    keep[0], keep[-1] = 0, n - 1
+    a = 0
+    for i in range(n_out - 2):
+        lo, hi = edges[i], edges[i + 1]
+        next_hi = edges[i + 2] if i + 2 < len(edges) else n
+        avg_x = x[hi:next_hi].mean()
+        avg_y = y[hi:next_hi].mean()
+        area = np.abs((x[a] - avg_x) * (y[lo:hi] - y[a]) - (x[a] - x[lo:hi]) * (avg_y - y[a]))
+        a = lo + int(np.argmax(area))
+        keep[i + 1] = a
+    return keep
+
+
+def downsample(x, y, n_out):
+    """去除缺值後以 LTTB 降到最多 n_out 點，回傳 (x, y)；點數不多時原樣回傳"""
+    x = np.asarray(x, dtype="float64")
+    y = np.asarray(y, dtype="float64")
+    valid = np.isfinite(x) & np.isfinite(y)
+    x, y = x[valid], y[valid]
+    keep = lttb(x, y, n_out)
+    return x[keep], y[keep]
+
+
+def points_per_series(n_series, max_points=MAX_POINTS):
+    """整張圖點數上限平均分給各序列後，每條序列可保留的點數"""
+    return max(MIN_POINTS_PER_SERIES, max_points // max(n_series, 1))
+
+
+def period_axis(fig, periods, period_col, max_ticks=MAX_TICKS):
+    """以整數期間索引為 x 軸，刻度顯示為 "113-5" / "113 Q2"，最多 max_ticks 個"""
+    periods = np.unique(np.asarray(periods, dtype="int64"))
+    if len(periods) > max_ticks:
+        periods = periods[np.linspace(0, len(periods) - 1, max_ticks).astype("int64")]
+    fig.update_xaxes(tickmode="array", tickvals=periods.tolist(), ticktext=period_labels(periods, period_col))
+    return fig
+
+
+@instrument()
+def line_figure(series, period_col, title="", xaxis_title="", yaxis_title="", max_points=MAX_POINTS):
+    """
+    時間序列折線圖。series 為 [(名稱, 期間索引, 數值), ...]。
+      - 每條序列以 LTTB 降採樣，整張圖最多約 max_points 點 (點數不多時保留全部資料)
+      - 總點數超過 WEBGL_THRESHOLD 時改用 Scattergl，點數少時維持 Scatter 並顯示標記
+    縮小期間範圍後重新繪圖即可取回該範圍的完整解析度。
+    """
+    n_out = points_per_series(len(series), max_points)
+    sampled = [(name,) + downsample(x, y, n_out) for name, x, y in series]
+    total = sum(len(x) for _, x, _ in sampled)
+    trace = go.Scattergl if total > WEBGL_THRESHOLD else go.Scatter
+    mode = "lines" if total > WEBGL_THRESHOLD else "lines+markers"
+    fig = go.Figure()
+    for name, x, y in sampled:
+        # x 為整數期間索引，滑鼠提示改以 "113-5" / "113 Q2" 顯示期間
+        fig.add_trace(trace(x=x, y=y, mode=mode, name=name, customdata=period_labels(x, period_col),
+                            hovertemplate="%{customdata}<br>%{y:,.2f}<extra>%{fullData.name}</extra>"))
+    fig.update_layout(title=title, xaxis_title=xaxis_title, yaxis_title=yaxis_title)
+    all_periods = np.concatenate([x for _, x, _ in sampled]) if sampled else np.array([])
+    return period_axis(fig, all_periods, period_col)
+
+
+@instrument()
+def heatmap_figure(values, row_labels, periods, period_col, title="", colorbar_title=""):
+    """
+    公司 × 期間矩陣的熱力圖，整個區塊為單一 Heatmap trace (不是每家公司一條)。
+    色階以 0 為中心 (RdYlGn)，範圍取絕對值的 98% 分位數，避免少數公司主導顏色。
+    """
+    finite = values[np.isfinite(values)]
+    bound = float(np.percentile(np.abs(finite), 98)) if finite.size else 0.0
+    bound = bound or 1.0
+    labels = np.array(period_labels(periods, period_col), dtype=object)
+    fig = go.Figure(go.Heatmap(
+        z=values, x=np.asarray(periods).tolist(), y=list(row_labels),
+        colorscale="RdYlGn", zmin=-bound, zmax=bound,
+        colorbar={"title": colorbar_title}, hoverongaps=False,
+        # 滑鼠提示以期間顯示字串取代整數期間索引
+        customdata=np.tile(labels, (len(row_labels), 1)),
+        hovertemplate="%{y}<br>%{customdata}<br>%{z:,.2f}<extra></extra>",
+    ))
+    fig.update_layout(title=title, height=max(400, 18 * len(row_labels) + 150))
+    # 列由上而下依排序顯示
+    fig.update_yaxes(autorange="reversed", type="category")
+    return period_axis(fig, periods, period_col)
@@ -0,0 +1,161 @@
+# companies.py
+import numpy as np
+import pandas as pd
+import streamlit as st
+from data_access import load_companies
+
+# 名稱搜尋索引的 n-gram 長度 (中文名稱以單字與雙字切分)
+NGRAM_SIZES = (1, 2)
+
+
+def _ngrams(text, size):
+    return {text[i:i + size] for i in range(len(text) - size + 1)}
+
+
+class CompanyDirectory:
+    """
+    公司目錄：公司代號 → 名稱 / 產業別 / 市場別，與選單用的顯示字串「代號 - 名稱」。
+    建立時一併整理代號字首索引 (排序後的代號字串，以 searchsorted 找字首範圍)
+    與名稱 n-gram 索引 (字 → 公司位置)，搜尋時不需逐一比對所有公司。
+    """
+    def __init__(self, companies):
+        companies = companies.drop_duplicates("公司代號").sort_values("公司代號").reset_index(drop=True)
+        self.frame = companies
+        self.codes = companies["公司代號"].to_numpy(dtype="int64")
+        self._position = {code: i for i, code in enumerate(self.codes.tolist())}
+        self._names = [self._text(x) for x in companies["公司名稱"]]
+        self._industries = [self._text(x) for x in companies.get("產業別", pd.Series(index=companies.index))]
+        self._markets = [self._text(x) for x in companies.get("市場別", pd.Series(index=companies.index))]
+        self._labels = [f"{code} - {name}" for code, name in zip(self.codes.tolist(), self._names)]
+        self.industries = sorted({x for x in self._industries if x})
+
+        # 代號字首索引：代號字串排序後，字首相同者必定相鄰
+        code_strings = np.array([str(code) for code in self.codes.tolist()])
+        order = np.argsort(code_strings, kind="stable")
+        self._code_strings = code_strings[order]
+        self._code_order = order
+        # 名稱 n-gram 索引
+        postings = {}
+        for i, name in enumerate(self._names):
+            for size in NGRAM_SIZES:
+                for gram in _ngrams(name.lower(), size):
+                    postings.setdefault(gram, []).append(i)
+        self._postings = {gram: np.array(rows) for gram, rows in postings.items()}
+
+    @staticmethod
+    def _text(value):
+        return "" if pd.isna(value) else str(value)
+
+    def __len__(self):
+        return len(self.codes)
+
+    def __contains__(self, code):
+        return code in self._position
+
+    def label(self, code):
+        """選單顯示字串「代號 - 名稱」；目錄中沒有的代號只顯示代號"""
+        i = self._position.get(code)
+        return str(code) if i is None else self._labels[i]
+
+    def name(self, code, default="未知"):
+        i = self._position.get(code)
+        return default if i is None or not self._names[i] else self._names[i]
+
+    def industry(self, code):
+        i = self._position.get(code)
+        return None if i is None or not self._industries[i] else self._industries[i]
+
+    def market(self, code):
+        i = self._position.get(code)
+        return None if i is None or not self._markets[i] else self._markets[i]
+
+    def names(self, codes, default="未知"):
+        return [self.name(code, default) for code in codes]
+
+    def codes_in_industry(self, industry):
+        """產業別為 industry 的公司代號 (依代號排序)"""
+        return [code for code, ind in zip(self.codes.tolist(), self._industries) if ind == industry]
+
+    def subset(self, codes):
+        """目錄中屬於 codes 的公司代號 (依代號排序)"""
+        return self.codes[np.isin(self.codes, np.asarray(codes, dtype="int64"))].tolist()
+
+    def table(self, codes):
+        """codes 的公司代號與名稱 (依 codes 順序)，供列表顯示"""
+        codes = list(codes)
+        return pd.DataFrame({"公司代號": codes, "公司名稱": self.names(codes)})
+
+    def _code_prefix(self, prefix):
+        lo = np.searchsorted(self._code_strings, prefix, side="left")
+        hi = np.searchsorted(self._code_strings, prefix + "\U0010ffff", side="left")
+        return np.sort(self._code_order[lo:hi])
+
+    def _name_contains(self, text):
+        size = min(len(text), max(NGRAM_SIZES))
+        grams = _ngrams(text, size)
+        rows = None
+        for gram in grams:
+            posting = self._postings.get(gram)
+            if posting is None:
+                return np.array([], dtype="int64")
+            rows = posting if rows is None else np.intersect1d(rows, posting, assume_unique=True)
+        # n-gram 交集只是候選，長於 n-gram 的查詢仍需確認整段字串相連
+        if len(text) > size:
+            rows = np.array([i for i in rows if text in self._names[i].lower()], dtype="int64")
+        return rows
+
+    def search(self, query, limit=None):
+        """
+        以代號字首或名稱片段搜尋公司，回傳公司代號清單：
+        代號字首相符者在前，其次為名稱包含查詢字串者，各自依代號排序。
+        空白查詢回傳全部公司。
+        """
+        query = query.strip().lower()
+        if not query:
+            codes = self.codes.tolist()
+            return codes if limit is None else codes[:limit]
+        rows = self._code_prefix(query) if query.isdigit() else np.array([], dtype="int64")
+        by_name = np.setdiff1d(self._name_contains(query), rows)
+        codes = self.codes[np.concatenate([rows, by_name]).astype("int64")].tolist()
+        return codes if limit is None else codes[:limit]
+
+
+@st.cache_resource(max_entries=1)
+def get_company_directory(version):
+    """
+    依資料版本快取的公司目錄 (所有頁面共用同一實例)。
+    呼叫端以 get_company_directory(data_version()) 取得。
+    """
+    return CompanyDirectory(load_companies())
+
+
+def company_selectbox(directory, label, codes=None, search=False, key=None):
+    """
+    單選公司選單，回傳公司代號 (選項本身即為代號，以「代號 - 名稱」顯示)。
+      - codes：可選的公司代號，None 表示目錄中全部公司
+      - search：是否在選單上方加一個代號 / 名稱搜尋框以縮小選項
+    沒有可選的公司時回傳 None。
+    """
+    options = directory.codes.tolist() if codes is None else list(codes)
+    if search:
+        query = st.text_input("搜尋公司 (代號或名稱)", key=None if key is None else f"{key}_search")
+        if query.strip():
+            allowed = set(options)
+            options = [code for code in directory.search(query) if code in allowed]
+            if not options:
+                st.warning("找不到符合的公司")
+                return None
+    return st.selectbox(label, options, format_func=directory.label, key=key)
+
+
+def company_multiselect(directory, label, codes=None, default=None, key=None):
+    """
+    多選公司選單，回傳所選的公司代號清單。
+      - codes：可選的公司代號，None 表示目錄中全部公司
+      - default：預設選取的公司代號 (不在選項中的代號會被略過)
+    """
+    options = directory.codes.tolist() if codes is None else list(codes)
+    if default is not None:
+        allowed = set(options)
+        default = [int(code) for code in default if int(code) in allowed]
+    return st.multiselect(label, options, default=default, format_func=directory.label, key=key)
@@ -0,0 +1,47 @@
+# company_store.py
+import numpy as np
+import streamlit as st
+from data_access import PERIOD_COLUMN, TABLES
+from metrics import period_index
+from instrumentation import instrument
+
+
+class CompanyStore:
+    """
+    依 (公司代號, 期間) 排序一次的資料，附公司偏移表 (代號 → [起, 迄) 列位置)。
+    同一公司的資料在排序後為連續區段，取單一公司只需切片，不需掃描整個資料表。
+    load_table 的資料已依 公司代號、年、月/季 排序，此時直接沿用原資料表，不另存排序後的副本。
+    """
+    def __init__(self, df, period_col):
+        codes = df["公司代號"].to_numpy(dtype="int64")
+        periods = period_index(df["年"], df[period_col], period_col)
+        order = np.lexsort((periods, codes))
+        self.period_col = period_col
+        already_sorted = bool(np.all(order[1:] > order[:-1]))
+        self.df = (df if already_sorted else df.take(order)).reset_index(drop=True)
+        codes = codes[order]
+        self.codes, starts = np.unique(codes, return_index=True)
+        ends = np.append(starts[1:], len(codes))
+        self._offsets = dict(zip(self.codes.tolist(), zip(starts.tolist(), ends.tolist())))
+
+    def __contains__(self, code):
+        return code in self._offsets
+
+    def bounds(self, code):
+        """公司在 self.df 中的列位置 (lo, hi)；沒有資料時為 (0, 0)"""
+        return self._offsets.get(code, (0, 0))
+
+    @instrument()
+    def company(self, code):
+        """單一公司的資料列 (依期間排序)，為 self.df 的切片，呼叫端不可直接修改"""
+        lo, hi = self.bounds(code)
+        return self.df.iloc[lo:hi]
+
+
+@st.cache_resource(max_entries=len(TABLES))
+def get_company_store(version, table, _datasets):
+    """
+    依資料版本快取的 CompanyStore，各 session 共用同一實例。
+    _datasets 為頁面的 data_access.Datasets，只有快取未命中時才會實際載入 table。
+    """
+    return CompanyStore(_datasets[table], PERIOD_COLUMN[table])
@@ -1,16 +1,448 @@
 # data_access.py
+import os
+import json
+import functools
+import queue
+import hashlib
 import sqlite3
+import tempfile
+import threading
+from contextlib import contextmanager
+from urllib.request import pathname2url
+import numpy as np
 import pandas as pd
 import streamlit as st
+from instrumentation import stage
+from metrics import calculate_monthly_metrics, calculate_quarterly_metrics
+
+# 資料庫與快照位置可由環境變數指定，預設為目前目錄下的 financial_data.db
+DB_PATH = os.environ.get("FINANCIAL_DB_PATH", "financial_data.db")
+# Parquet 快照存放位置，內容由 financial_data.db 產生，可隨時刪除重建
+SNAPSHOT_DIR = os.environ.get("FINANCIAL_SNAPSHOT_DIR", "financial_data_snapshot")
+# 唯讀連線的記憶體映射大小 (bytes)
+MMAP_SIZE = 256 * 1024 * 1024
+SNAPSHOT_MANIFEST = "manifest.json"
+TABLES = ("monthly_revenue", "quarterly_report")
+# 匯入資料時由 data_pipeline 預先計算的指標表
+METRIC_TABLES = {"monthly_revenue": "monthly_metrics", "quarterly_report": "quarterly_metrics"}
+# 匯入時預先彙總的產業 × 期間統計表 (見 metrics.industry_cube)
+CUBE_TABLES = {"monthly_revenue": "monthly_industry_cube", "quarterly_report": "quarterly_industry_cube"}
+# 文字欄位，其餘欄位一律轉為數值型別
+TEXT_COLUMNS = {"公司名稱", "產業別", "備註", "市場別", "指標"}
+# 期間與代號欄位的固定型別 (年*12+月 等運算不會溢位)
+KEY_DTYPES = {"年": "int16", "月": "int8", "季": "int8", "公司代號": "int32"}
+# 數值欄位轉為 float32 時允許的相對誤差
+FLOAT32_RTOL = 1e-6
+# 各資料表的期間欄位 (月營收以月、季報以季)
+PERIOD_COLUMN = {"monthly_revenue": "月", "quarterly_report": "季"}
+
+
+def _db_files(db_path):
+    """
+    資料庫本體與 WAL 檔 (若存在且不為空)。
+    WAL 模式的資料庫第一次被唯讀連線開啟時會建立空的 -wal 檔，內容並未改變，因此不列入。
+    """
+    files = [db_path]
+    wal_path = db_path + "-wal"
+    if os.path.exists(wal_path) and os.path.getsize(wal_path) > 0:
+        files.append(wal_path)
+    return [path for path in files if os.path.exists(path)]
+
+
+def _db_signature(db_path):
+    """以檔案大小與修改時間作為快速比對用的簽章 (data_version 與快照 manifest 共用)"""
+    signature = []
+    for path in _db_files(db_path):
+        stat = os.stat(path)
+        signature.append([os.path.basename(path), stat.st_size, stat.st_mtime_ns])
+    return signature
+
+
+def _db_hash(db_path, signature=None):
+    """
+    計算資料庫內容的 SHA-256，僅在簽章改變時使用。
+    同一簽章的結果會保留，快照檢查與重建快照時不必各讀一次整個資料庫。
+    """
+    signature = json.dumps(signature if signature is not None else _db_signature(db_path))
+    return _cached_db_hash(os.path.abspath(db_path), signature)
+
+
+@functools.lru_cache(maxsize=4)
+def _cached_db_hash(db_path, signature):
+    digest = hashlib.sha256()
+    for path in _db_files(db_path):
+        with open(path, "rb") as f:
+            for chunk in iter(lambda: f.read(1 << 20), b""):
+                digest.update(chunk)
+    return digest.hexdigest()
+
+
+def data_version(db_path=DB_PATH):
+    """
+    目前資料庫的版本字串，資料庫有任何寫入時即改變。
+    供 st.cache_data 作為快取鍵，使資料更新後自動重新載入。
+    """
+    return json.dumps(_db_signature(db_path))
+
+
+def _coerce_types(df):
+    """文字欄位維持字串，其餘欄位轉為數值 (舊資料庫可能以 TEXT 儲存金額)"""
+    for col in df.columns:
+        if col not in TEXT_COLUMNS and not pd.api.types.is_numeric_dtype(df[col]):
+            df[col] = pd.to_numeric(df[col], errors="coerce")
+    return df
+
+
+def _nullable(dtype):
+    """numpy 整數型別對應的 nullable 型別，例如 int32 → Int32"""
+    dtype = pd.api.types.pandas_dtype(dtype)
+    if isinstance(dtype, pd.api.extensions.ExtensionDtype):
+        return dtype
+    return dtype.name.capitalize()
+
+
+def _compact_numeric(series):
+    """
+    數值欄位縮小型別：
+      - 全為整數：縮為可容納的最小整數型別，有缺值時使用 nullable 整數
+      - 含小數：float32 足以表示 (相對誤差 ≤ FLOAT32_RTOL) 時改用 float32
+    """
+    values = series.dropna()
+    if values.empty:
+        return series.astype("float32")
+    if (values % 1 == 0).all():
+        dtype = pd.to_numeric(values, downcast="integer").dtype
+        return series.astype(_nullable(dtype) if series.hasnans else dtype)
+    if pd.api.types.is_float_dtype(series) and series.dtype.itemsize > 4:
+        as_float32 = values.astype("float32").astype("float64")
+        if np.allclose(as_float32, values.astype("float64"), rtol=FLOAT32_RTOL, atol=0):
+            return series.astype("float32")
+    return series
+
+
+def compact_dtypes(df):
+    """
+    縮小整個資料表的記憶體用量：
+      - 重複出現的文字欄位 (公司名稱、產業別等) 改為 category
+      - 年、月、季、公司代號使用 KEY_DTYPES 的小整數型別
+      - 其他數值欄位交由 _compact_numeric 判斷
+    """
+    for col in df.columns:
+        series = df[col]
+        if col in TEXT_COLUMNS:
+            if not isinstance(series.dtype, pd.CategoricalDtype):
+                df[col] = series.astype("category")
+        elif col in KEY_DTYPES:
+            dtype = KEY_DTYPES[col]
+            df[col] = series.astype(_nullable(dtype) if series.hasnans else dtype)
+        elif pd.api.types.is_numeric_dtype(series):
+            df[col] = _compact_numeric(series)
+    return df
+
+
+def _memory_mb(df):
+    return df.memory_usage(deep=True).sum() / 1024 ** 2
+
+
+def _read_manifest(snapshot_dir):
+    path = os.path.join(snapshot_dir, SNAPSHOT_MANIFEST)
+    if not os.path.exists(path):
+        return None
+    with open(path, "r", encoding="utf-8") as f:
+        return json.load(f)
+
+
+@contextmanager
+def _atomic_path(path):
+    """
+    產生與 path 同目錄、名稱唯一的暫存檔路徑，寫入完成後以 os.replace 置換成 path。
+    多個 app 副本共用同一快照目錄時，同時重建快照也不會寫到同一個暫存檔；寫入失敗時刪除暫存檔。
+    """
+    fd, tmp_path = tempfile.mkstemp(dir=os.path.dirname(path) or ".", prefix=os.path.basename(path) + ".",
+                                    suffix=".tmp")
+    os.close(fd)
+    try:
+        yield tmp_path
+        os.replace(tmp_path, path)
+    finally:
+        if os.path.exists(tmp_path):
+            os.remove(tmp_path)
+
+
+def _write_manifest(snapshot_dir, manifest):
+    with _atomic_path(os.path.join(snapshot_dir, SNAPSHOT_MANIFEST)) as tmp_path:
+        with open(tmp_path, "w", encoding="utf-8") as f:
+            json.dump(manifest, f)
+
+
+def _snapshot_is_fresh(db_path, snapshot_dir):
+    """
+    判斷快照是否仍對應目前的資料庫：
+      - 簽章 (大小、修改時間) 相同即視為最新
+      - 簽章不同但內容雜湊相同 (例如僅被 touch 或複製)，更新簽章後沿用快照
+    """
+    manifest = _read_manifest(snapshot_dir)
+    if manifest is None:
+        return False
+    if not all(os.path.exists(os.path.join(snapshot_dir, f"{table}.parquet"))
+               for table in manifest.get("tables", TABLES)):
+        return False
+    signature = _db_signature(db_path)
+    if signature == manifest.get("signature"):
+        return True
+    if _db_hash(db_path, signature) == manifest.get("sha256"):
+        manifest["signature"] = signature
+        _write_manifest(snapshot_dir, manifest)
+        return True
+    return False
+
+
+class ReadOnlyConnectionPool:
+    """
+    process 內共用的 SQLite 唯讀連線池。
+    連線以 mode=ro URI 開啟並設定 query_only 與 mmap_size；
+    每次 connection() 借出一條連線給目前的執行緒獨佔使用，用完歸還供其他 session 重複使用。
+    資料庫檔案被整個置換 (inode 改變) 時，舊連線會被捨棄。
+    """
+    def __init__(self, db_path, mmap_size=MMAP_SIZE):
+        self.db_path = os.path.abspath(db_path)
+        self.uri = f"file:{pathname2url(self.db_path)}?mode=ro"
+        self.mmap_size = mmap_size
+        self._idle = queue.LifoQueue()
+        self._lock = threading.Lock()
+        self._inode = None
+
+    def _open(self):
+        # 連線會在不同執行緒間輪流使用 (同一時間只有一個)，因此關閉 check_same_thread
+        conn = sqlite3.connect(self.uri, uri=True, check_same_thread=False)
+        conn.execute("PRAGMA query_only = ON")
+        conn.execute(f"PRAGMA mmap_size = {int(self.mmap_size)}")
+        return conn
+
+    def _discard_if_replaced(self):
+        inode = os.stat(self.db_path).st_ino
+        with self._lock:
+            if inode == self._inode:
+                return
+            self._inode = inode
+            while True:
+                try:
+                    self._idle.get_nowait().close()
+                except queue.Empty:
+                    break
+
+    @contextmanager
+    def connection(self):
+        self._discard_if_replaced()
+        try:
+            conn = self._idle.get_nowait()
+        except queue.Empty:
+            conn = self._open()
+        try:
+            yield conn
+        except Exception:
+            conn.close()
+            raise
+        else:
+            self._idle.put(conn)
+
+
+@st.cache_resource
+def get_connection_pool(db_path=DB_PATH):
+    """依資料庫路徑取得 process 共用的唯讀連線池"""
+    return ReadOnlyConnectionPool(db_path)
+
+
+def _read_tables_from_sqlite(db_path, tables=TABLES):
+    """讀取資料表與其已存在的指標表"""
+    with get_connection_pool(db_path).connection() as conn:
+        existing = {row[0] for row in conn.execute("SELECT name FROM sqlite_master WHERE type = 'table'")}
+        tables = list(tables) + [METRIC_TABLES[table] for table in tables if METRIC_TABLES[table] in existing]
+        return {table: _coerce_types(pd.read_sql_query(f'SELECT * FROM "{table}"', conn))
+                for table in tables}
+
+
+def _compact_frames(frames):
+    """
+    對 SQLite 讀出的原始資料表套用 compact_dtypes，
+    回傳 (壓縮後的資料表, {資料表: [壓縮前 MB, 壓縮後 MB]})。
+    """
+    memory = {}
+    for table, df in frames.items():
+        before = _memory_mb(df)
+        frames[table] = compact_dtypes(df)
+        memory[table] = [before, _memory_mb(frames[table])]
+    return frames, memory
+
+
+def _report_memory(frames, memory):
+    for name, df in frames.items():
+        if name in memory:
+            before, after = memory[name]
+            print(f"📦 {name}: {len(df)} 列，記憶體 {before:.1f} MB → {after:.1f} MB")
+
+
+def _write_snapshot(frames, memory, signature, db_path, snapshot_dir):
+    """
+    將已讀出的資料表寫成 Parquet 快照與 manifest，signature 為讀取前的資料庫簽章。
+    快照先寫入暫存檔再置換，避免讀取端看到寫到一半的檔案。
+    """
+    os.makedirs(snapshot_dir, exist_ok=True)
+    for table, df in frames.items():
+        with _atomic_path(os.path.join(snapshot_dir, f"{table}.parquet")) as tmp_path:
+            df.to_parquet(tmp_path, index=False)
+    _write_manifest(snapshot_dir, {"signature": signature, "sha256": _db_hash(db_path, signature),
+                                   "tables": list(frames), "memory_mb": memory})
+
+
+def build_snapshot(db_path=DB_PATH, snapshot_dir=SNAPSHOT_DIR):
+    """
+    從 SQLite 讀取全部資料表並寫成 Parquet 快照，回傳 (資料表, 記憶體用量)。
+    Parquet 保存的是壓縮後的型別，因此壓縮前後的記憶體用量在此量測並記錄於 manifest。
+    """
+    signature = _db_signature(db_path)
+    frames, memory = _compact_frames(_read_tables_from_sqlite(db_path))
+    _write_snapshot(frames, memory, signature, db_path, snapshot_dir)
+    return frames, memory
+
+
+def _load_tables(tables=TABLES, db_path=DB_PATH, snapshot_dir=SNAPSHOT_DIR):
+    """
+    讀取 tables 與其指標表 (皆已套用 compact_dtypes)：快照為最新時只讀所需的 Parquet 檔，
+    否則從 SQLite 讀取全部資料表重建快照後取出所需部分；快照寫入失敗時沿用同一次讀取的結果。
+    回傳 (資料表, {資料表: [壓縮前 MB, 壓縮後 MB]})，記憶體用量取自快照 manifest。
+    """
+    wanted = [name for table in tables for name in (table, METRIC_TABLES[table])]
+    if _snapshot_is_fresh(db_path, snapshot_dir):
+        manifest = _read_manifest(snapshot_dir)
+        available = manifest.get("tables", TABLES)
+        frames = {name: pd.read_parquet(os.path.join(snapshot_dir, f"{name}.parquet"))
+                  for name in wanted if name in available}
+        return frames, manifest.get("memory_mb", {})
+    signature = _db_signature(db_path)
+    frames, memory = _compact_frames(_read_tables_from_sqlite(db_path))
+    try:
+        _write_snapshot(frames, memory, signature, db_path, snapshot_dir)
+    except OSError as e:
+        # 唯讀環境無法寫入快照時，直接使用已從 SQLite 讀出的結果
+        print(f"⚠️ 無法寫入快照 {snapshot_dir}: {e}")
+    return {name: frames[name] for name in wanted if name in frames}, memory
+
+
+def _compute_metrics(df, table):
+    """以 metrics.py 即時計算指標 (資料庫尚未建立指標表時使用)"""
+    if table == "monthly_revenue":
+        return calculate_monthly_metrics(df)
+    return calculate_quarterly_metrics(df)
+
+
+def _attach_metrics(df, metrics_df, table):
+    """將預先計算的指標欄位併入資料表，並依 公司代號、年、月/季 排序"""
+    if metrics_df is None:
+        return _compute_metrics(df, table)
+    keys = ["公司代號", "年", PERIOD_COLUMN[table]]
+    return df.merge(metrics_df, on=keys, how="left").sort_values(keys, ignore_index=True)
+
+
+@st.cache_data(max_entries=len(TABLES))
+def _load_table(version, table):
+    if table not in PERIOD_COLUMN:
+        raise ValueError(f"未知的資料表: {table}")
+    with stage(f"讀取 {table} (快取未命中)"):
+        frames, memory = _load_tables((table,))
+    _report_memory(frames, memory)
+    return _attach_metrics(frames[table], frames.get(METRIC_TABLES[table]), table)
+
+
+def load_table(table):
+    """
+    讀取單一資料表 ("monthly_revenue" 或 "quarterly_report")，只載入該表與其指標表。
+    資料庫預設為目前目錄下的 financial_data.db，可用環境變數 FINANCIAL_DB_PATH 指定；
+    優先讀取由資料庫產生的 Parquet 快照，資料庫變動後才回頭讀 SQLite 並重建快照。
+    回傳的資料表已套用 compact_dtypes (文字欄位為 category)，
+    並已併入資料匯入時預先計算的指標欄位 (metrics.MONTHLY_METRIC_COLUMNS / QUARTERLY_METRIC_COLUMNS)。
+    """
+    with stage(f"load_table {table}") as record:
+        df = _load_table(data_version(), table)
+        record.rows = len(df)
+    return df
+
 
-@st.cache_data
 def load_data():
+    """讀取月營收與季報資料 (見 load_table)，回傳 (monthly_df, quarterly_df)"""
+    return tuple(load_table(table) for table in TABLES)
+
+
+class Datasets:
+    """
+    頁面宣告需要的資料表，第一次取用 datasets[table] 時才載入 (load_table)，
+    同一次執行中重複取用回傳同一份資料。取用未宣告的資料表會引發 KeyError。
+    """
+    def __init__(self, tables):
+        self.tables = tuple(tables)
+        self._frames = {}
+
+    def __getitem__(self, table):
+        if table not in self.tables:
+            raise KeyError(f"頁面未宣告需要資料表: {table}")
+        if table not in self._frames:
+            self._frames[table] = load_table(table)
+        return self._frames[table]
+
+
+# 資料表、指標表與產業彙總表各一份
+@st.cache_data(max_entries=len(TABLES) * 3)
+def _table_columns(version, table):
+    """資料表的欄位名稱 (依資料表定義順序)"""
+    with get_connection_pool().connection() as conn:
+        return [row[1] for row in conn.execute(f'PRAGMA table_info("{table}")')]
+
+
+def _query(sql, params):
+    with get_connection_pool().connection() as conn:
+        return _coerce_types(pd.read_sql_query(sql, conn, params=params))
+
+
+@st.cache_data(max_entries=1)
+def _load_companies(version):
+    # 每家公司取最新一期的名稱、產業別與市場別 (SQLite 的 MAX() 聚合會一併帶出該列的其他欄位)
+    market = '"市場別"' if "市場別" in _table_columns(version, "monthly_revenue") else 'NULL AS "市場別"'
+    monthly = _query(f'SELECT "公司代號", "公司名稱", "產業別", {market}, MAX("年" * 12 + "月") AS "最新期間" '
+                     f'FROM "monthly_revenue" GROUP BY "公司代號"', [])
+    # 只有季報資料的公司也列入 (季報沒有產業別與市場別)
+    quarterly = _query('SELECT "公司代號", "公司名稱", MAX("年" * 4 + "季") AS "最新期間" '
+                       'FROM "quarterly_report" GROUP BY "公司代號"', [])
+    quarterly = quarterly[~quarterly["公司代號"].isin(monthly["公司代號"])]
+    companies = pd.concat([monthly, quarterly], ignore_index=True)
+    return companies.drop(columns="最新期間").sort_values("公司代號").reset_index(drop=True)
+
+
+def load_companies():
+    """所有公司的代號、名稱、產業別與市場別 (各取最新一期)，供選單使用"""
+    return _load_companies(data_version())
+
+
+@st.cache_data(max_entries=len(TABLES))
+def _load_industry_cube(version, table):
+    period_col = PERIOD_COLUMN[table]
+    if not _table_columns(version, CUBE_TABLES[table]):
+        print(f"⚠️ 資料庫沒有 {CUBE_TABLES[table]}，請執行 data_pipeline/insert_data_to_DB.py 建立產業彙總表")
+        return pd.DataFrame()
+    df = _query(f'SELECT * FROM "{CUBE_TABLES[table]}" ORDER BY "產業別", "指標", "年", "{period_col}"', [])
+    for col in ("產業別", "指標"):
+        df[col] = df[col].astype("category")
+    # 家數與分布以 REAL 欄位儲存，讀出後還原為整數
+    for col in df.columns:
+        if col == "家數" or col.startswith("分布_"):
+            df[col] = df[col].fillna(0).astype("int64")
+    return df
+
+
+def load_industry_cube(table="monthly_revenue"):
     """
-    從 local SQLite 資料庫讀取資料。
-    資料庫檔案需與此程式同目錄，檔名為 financial_data.db
+    產業 × 期間彙總表 (每個 產業別、年、月/季、指標 一列，欄位見 metrics.CUBE_STAT_COLUMNS)。
+    只讀取匯入時預先計算的小表，不載入公司層級資料；資料庫尚未建立彙總表時回傳空表。
     """
-    conn = sqlite3.connect("financial_data.db")
-    monthly_df = pd.read_sql_query('SELECT * FROM monthly_revenue', conn)
-    quarterly_df = pd.read_sql_query('SELECT * FROM quarterly_report', conn)
-    conn.close()
-    return monthly_df, quarterly_df
+    if table not in CUBE_TABLES:
+        raise ValueError(f"未知的資料表: {table}")
+    return _load_industry_cube(data_version(), table)
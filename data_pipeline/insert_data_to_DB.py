@@ -1,60 +1,414 @@
 import os
+import sys
+import hashlib
 import sqlite3
+from datetime import datetime
 import pandas as pd
 
+# metrics.py 位於專案根目錄，匯入時與前端共用同一份指標定義
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+from metrics import (MONTHLY_METRIC_COLUMNS, QUARTERLY_METRIC_COLUMNS, build_metric_frames,
+                     MONTHLY_PEER_RANK_COLUMNS, QUARTERLY_PEER_RANK_COLUMNS, CUBE_STAT_COLUMNS,
+                     affected_periods, source_periods, recompute_period_frame,
+                     metric_table_columns, industry_cube)
+
+# 資料庫結構版本，記錄在 PRAGMA user_version；結構變更時遞增並於 migrate() 處理
+#   1: 具型別、主鍵與索引的 monthly_revenue / quarterly_report
+#   2: 新增 ingest_manifest 匯入紀錄表
+#   3: 新增預先計算的指標表 monthly_metrics / quarterly_metrics
+#   4: 指標表新增產業同業百分位欄位 (重建指標表，由 refresh_metrics 全部重算)
+#   5: 新增產業 × 期間彙總表 monthly_industry_cube / quarterly_industry_cube
+SCHEMA_VERSION = 5
+
+# 匯入紀錄表：記錄每個已匯入 CSV 的內容雜湊，內容未變的檔案不再重複匯入
+MANIFEST_TABLE = "ingest_manifest"
+
+# 大量寫入用的連線設定
+PRAGMAS = (
+    "PRAGMA journal_mode = WAL",
+    "PRAGMA synchronous = NORMAL",
+    "PRAGMA cache_size = -65536",  # 約 64 MB
+    "PRAGMA temp_store = MEMORY",
+)
+
+# 各資料表的欄位定義、主鍵與次要索引
+TABLE_SCHEMAS = {
+    "monthly_revenue": {
+        "columns": [
+            ("年", "INTEGER NOT NULL"),
+            ("月", "INTEGER NOT NULL"),
+            ("公司代號", "INTEGER NOT NULL"),
+            ("公司名稱", "TEXT"),
+            ("產業別", "TEXT"),
+            ("營業收入-當月營收", "INTEGER"),
+            ("備註", "TEXT"),
+            ("市場別", "TEXT"),  # sii (上市) / otc (上櫃)，由檔名取得
+        ],
+        "primary_key": ("公司代號", "年", "月"),
+        "indexes": {
+            "idx_monthly_revenue_period": ("年", "月"),
+            "idx_monthly_revenue_industry": ("產業別",),
+        },
+    },
+    "quarterly_report": {
+        "columns": [
+            ("年", "INTEGER NOT NULL"),
+            ("季", "INTEGER NOT NULL"),
+            ("公司代號", "INTEGER NOT NULL"),
+            ("公司名稱", "TEXT"),
+            ("資產總計(額)", "INTEGER"),
+            ("負債總計(額)", "INTEGER"),
+            ("股本", "INTEGER"),
+            ("資本公積", "INTEGER"),
+            ("保留盈餘(或累積虧損)", "INTEGER"),
+            ("其他權益", "INTEGER"),
+            ("歸屬於母公司業主之權益(合計)", "INTEGER"),
+            ("權益總計(額)", "INTEGER"),
+            ("母公司暨子公司持有之母公司庫藏股股數（單位：股）", "INTEGER"),
+            ("每股參考淨值", "REAL"),
+            ("流動資產", "INTEGER"),
+            ("非流動資產", "INTEGER"),
+            ("流動負債", "INTEGER"),
+            ("非流動負債", "INTEGER"),
+            ("基本每股盈餘（元）", "REAL"),
+            ("所得稅費用（利益）", "INTEGER"),
+            ("營業成本", "INTEGER"),
+            ("營業收入", "INTEGER"),
+            ("營業毛利（毛損）", "INTEGER"),
+            ("營業費用", "INTEGER"),
+            ("稅前淨利（淨損）", "INTEGER"),
+            ("綜合損益總額歸屬於母公司業主", "INTEGER"),
+        ],
+        "primary_key": ("公司代號", "年", "季"),
+        "indexes": {
+            "idx_quarterly_report_period": ("年", "季"),
+        },
+    },
+}
+
+# 由 metrics.py 計算、於匯入時寫入的指標表，主鍵與來源資料表相同
+METRIC_TABLE_SCHEMAS = {
+    "monthly_metrics": {
+        "columns": [("公司代號", "INTEGER NOT NULL"), ("年", "INTEGER NOT NULL"), ("月", "INTEGER NOT NULL")]
+                   + [(col, "REAL") for col in MONTHLY_METRIC_COLUMNS + MONTHLY_PEER_RANK_COLUMNS],
+        "primary_key": ("公司代號", "年", "月"),
+        "indexes": {},
+    },
+    "quarterly_metrics": {
+        "columns": [("公司代號", "INTEGER NOT NULL"), ("年", "INTEGER NOT NULL"), ("季", "INTEGER NOT NULL")]
+                   + [(col, "REAL") for col in QUARTERLY_METRIC_COLUMNS + QUARTERLY_PEER_RANK_COLUMNS],
+        "primary_key": ("公司代號", "年", "季"),
+        "indexes": {},
+    },
+}
+
+# 產業 × 期間彙總表 (metrics.industry_cube)：每個 (產業別, 年, 月/季, 指標) 一列，
+# 與指標表在同一次 refresh_metrics 中計算，產業分析頁只讀取這兩張小表
+CUBE_TABLE_SCHEMAS = {
+    "monthly_industry_cube": {
+        "columns": [("產業別", "TEXT NOT NULL"), ("年", "INTEGER NOT NULL"), ("月", "INTEGER NOT NULL"),
+                    ("指標", "TEXT NOT NULL")] + [(col, "REAL") for col in CUBE_STAT_COLUMNS],
+        "primary_key": ("產業別", "年", "月", "指標"),
+        "indexes": {},
+    },
+    "quarterly_industry_cube": {
+        "columns": [("產業別", "TEXT NOT NULL"), ("年", "INTEGER NOT NULL"), ("季", "INTEGER NOT NULL"),
+                    ("指標", "TEXT NOT NULL")] + [(col, "REAL") for col in CUBE_STAT_COLUMNS],
+        "primary_key": ("產業別", "年", "季", "指標"),
+        "indexes": {},
+    },
+}
+
+# 來源資料表 → (指標表, 產業彙總表)
+DERIVED_TABLES = {
+    "monthly_revenue": ("monthly_metrics", "monthly_industry_cube"),
+    "quarterly_report": ("quarterly_metrics", "quarterly_industry_cube"),
+}
+
+
+def _schema(table_name):
+    return TABLE_SCHEMAS.get(table_name) or METRIC_TABLE_SCHEMAS.get(table_name) or CUBE_TABLE_SCHEMAS[table_name]
+
+
+def _quote(name):
+    return '"' + name.replace('"', '""') + '"'
+
+
+def _file_sha256(path):
+    digest = hashlib.sha256()
+    with open(path, "rb") as f:
+        for chunk in iter(lambda: f.read(1 << 20), b""):
+            digest.update(chunk)
+    return digest.hexdigest()
+
+
+def _market_from_filename(filename):
+    """monthly_revenue_{market}_{year}_{month}.csv → market，其他檔名回傳 None"""
+    parts = os.path.splitext(filename)[0].split("_")
+    if len(parts) == 5 and parts[:2] == ["monthly", "revenue"]:
+        return parts[2]
+    return None
+
+
 class DatabaseManager:
     def __init__(self, db_name="financial_data.db"):
         """初始化資料庫名稱"""
         self.db_name = db_name
         self.conn = sqlite3.connect(self.db_name)
         self.cursor = self.conn.cursor()
+        for pragma in PRAGMAS:
+            self.cursor.execute(pragma)
+
+    def _table_exists(self, table_name):
+        row = self.cursor.execute(
+            "SELECT 1 FROM sqlite_master WHERE type = 'table' AND name = ?", (table_name,)
+        ).fetchone()
+        return row is not None
+
+    def _create_table(self, table_name, target_name=None):
+        """依 TABLE_SCHEMAS / METRIC_TABLE_SCHEMAS / CUBE_TABLE_SCHEMAS 建立資料表 (含主鍵)，target_name 可指定實際建立的名稱"""
+        schema = _schema(table_name)
+        columns_sql = ", ".join(f"{_quote(col)} {col_type}" for col, col_type in schema["columns"])
+        pk_sql = ", ".join(_quote(col) for col in schema["primary_key"])
+        self.cursor.execute(
+            f"CREATE TABLE IF NOT EXISTS {_quote(target_name or table_name)} "
+            f"({columns_sql}, PRIMARY KEY ({pk_sql}))"
+        )
 
-    def create_table_from_csv(self, sample_csv_path, table_name):
+    def _create_indexes(self, table_name):
+        for index_name, columns in _schema(table_name)["indexes"].items():
+            columns_sql = ", ".join(_quote(col) for col in columns)
+            self.cursor.execute(
+                f"CREATE INDEX IF NOT EXISTS {_quote(index_name)} ON {_quote(table_name)} ({columns_sql})"
+            )
+
+    def _rebuild_table(self, table_name):
         """
-        根據 CSV 檔案建立資料表 (不使用 id)
-        - sample_csv_path: CSV 檔案路徑 (用來分析欄位)
-        - table_name: 要建立的資料表名稱
+        將舊版 (由 CSV 推斷型別、無主鍵) 的資料表重建為目前的結構：
+          - 數值欄位去除逗號與空白後交由 INTEGER/REAL 欄位轉型
+          - 主鍵欄位為空的列捨棄，重複列保留最後一筆
         """
-        df = pd.read_csv(sample_csv_path)
-
-        # 轉換 Pandas 資料型別為 SQLite 適用的型別
-        column_types = {}
-        for col in df.columns:
-            if df[col].dtype == "int64":
-                column_types[col] = "INTEGER"
-            elif df[col].dtype == "float64":
-                column_types[col] = "REAL"
+        schema = TABLE_SCHEMAS[table_name]
+        legacy_columns = {row[1] for row in self.cursor.execute(f"PRAGMA table_info({_quote(table_name)})")}
+        new_name = f"{table_name}_rebuild"
+        self.cursor.execute(f"DROP TABLE IF EXISTS {_quote(new_name)}")
+        self._create_table(table_name, target_name=new_name)
+
+        target_cols, select_exprs = [], []
+        for col, col_type in schema["columns"]:
+            if col not in legacy_columns:
+                continue
+            target_cols.append(_quote(col))
+            if col_type.startswith("TEXT"):
+                select_exprs.append(_quote(col))
             else:
-                column_types[col] = "TEXT"
+                select_exprs.append(f"NULLIF(REPLACE(TRIM({_quote(col)}), ',', ''), '')")
+        not_null = " AND ".join(
+            f"NULLIF(TRIM({_quote(col)}), '') IS NOT NULL" for col in schema["primary_key"]
+        )
+        self.cursor.execute(
+            f"INSERT OR REPLACE INTO {_quote(new_name)} ({', '.join(target_cols)}) "
+            f"SELECT {', '.join(select_exprs)} FROM {_quote(table_name)} WHERE {not_null} ORDER BY rowid"
+        )
+        self.cursor.execute(f"DROP TABLE {_quote(table_name)}")
+        self.cursor.execute(f"ALTER TABLE {_quote(new_name)} RENAME TO {_quote(table_name)}")
 
-        # 動態建立 SQL 語法 (移除 id 欄位)
-        columns_sql = ", ".join([f'"{col}" {col_type}' for col, col_type in column_types.items()])
-        create_table_sql = f'CREATE TABLE IF NOT EXISTS "{table_name}" ({columns_sql})'
-        
-        self.cursor.execute(create_table_sql)
+    def migrate(self):
+        """
+        確保資料庫結構為 SCHEMA_VERSION：
+        舊版資料表會重建為具型別、主鍵的版本，補上索引後執行 ANALYZE 更新查詢統計。
+        """
+        current_version = self.cursor.execute("PRAGMA user_version").fetchone()[0]
+        if current_version == SCHEMA_VERSION:
+            return
+        with self.conn:
+            # 明確開始交易，使 DDL 與資料搬移一併提交或回復
+            self.cursor.execute("BEGIN")
+            if current_version < 1:
+                for table_name in TABLE_SCHEMAS:
+                    if self._table_exists(table_name):
+                        self._rebuild_table(table_name)
+                        print(f"✅ 已將 {table_name} 重建為具型別與主鍵的結構")
+                    else:
+                        self._create_table(table_name)
+                    self._create_indexes(table_name)
+            if current_version < 2:
+                self.cursor.execute(
+                    f"CREATE TABLE IF NOT EXISTS {MANIFEST_TABLE} ("
+                    "table_name TEXT NOT NULL, file_name TEXT NOT NULL, sha256 TEXT NOT NULL, "
+                    "row_count INTEGER, ingested_at TEXT, PRIMARY KEY (table_name, file_name))"
+                )
+            if current_version < 4:
+                # 指標表欄位變動：重建為空表，main() 偵測到指標表為空時會全部重算
+                for table_name in METRIC_TABLE_SCHEMAS:
+                    self.cursor.execute(f"DROP TABLE IF EXISTS {_quote(table_name)}")
+                    self._create_table(table_name)
+                    self._create_indexes(table_name)
+            if current_version < 5:
+                # 新增的彙總表為空，main() 偵測到時會全部重算
+                for table_name in CUBE_TABLE_SCHEMAS:
+                    self._create_table(table_name)
+            self.cursor.execute(f"PRAGMA user_version = {SCHEMA_VERSION}")
+        self.cursor.execute("ANALYZE")
         self.conn.commit()
 
-        print(f"✅ 成功建立 {table_name} 資料表")
+    def _upsert_sql(self, table_name):
+        """INSERT ... ON CONFLICT DO UPDATE：主鍵相同時以新資料覆蓋其餘欄位"""
+        schema = _schema(table_name)
+        columns = [col for col, _ in schema["columns"]]
+        pk = schema["primary_key"]
+        placeholders = ", ".join("?" for _ in columns)
+        updates = ", ".join(f"{_quote(col)} = excluded.{_quote(col)}" for col in columns if col not in pk)
+        return (
+            f"INSERT INTO {_quote(table_name)} ({', '.join(_quote(col) for col in columns)}) "
+            f"VALUES ({placeholders}) "
+            f"ON CONFLICT ({', '.join(_quote(col) for col in pk)}) DO UPDATE SET {updates}"
+        )
 
-    def insert_data_from_csv(self, folder_path, table_name):
+    def _read_rows(self, file_path, table_name):
+        """讀取 CSV 並整理成資料表欄位順序的 tuple 列，主鍵欄位為空的列捨棄"""
+        schema = TABLE_SCHEMAS[table_name]
+        columns = [col for col, _ in schema["columns"]]
+        df = pd.read_csv(file_path)
+        if "市場別" in columns and "市場別" not in df.columns:
+            df["市場別"] = _market_from_filename(os.path.basename(file_path))
+        df = df.reindex(columns=columns)
+        df = df.dropna(subset=list(schema["primary_key"]))
+        df = df.astype(object).where(df.notna(), None)
+        return list(df.itertuples(index=False, name=None))
+
+    def insert_data_from_csv(self, folder_path, table_name, batch_size=50):
         """
-        從 CSV 資料夾讀取數據並存入指定資料表
+        從 CSV 資料夾讀取數據並存入指定資料表 (增量匯入)：
+          - 以 ingest_manifest 記錄的檔案雜湊判斷，內容未變的檔案直接略過
+          - 每 batch_size 個檔案為一筆交易，以 executemany 寫入，檔案紀錄與資料一併提交
+          - 主鍵衝突時以新資料覆蓋 (upsert)，重複執行不會產生重複列
+        回傳本次匯入資料涵蓋的期間 [(年, 月/季), ...]，供 refresh_metrics 增量更新指標。
         """
-        files = [f for f in os.listdir(folder_path) if f.endswith(".csv")]
+        files = sorted(f for f in os.listdir(folder_path) if f.endswith(".csv"))
         if not files:
             print(f"⚠️ 找不到任何 CSV 檔案於 {folder_path}")
-            return
+            return []
 
-        # 先用第一個 CSV 建表
-        sample_csv_path = os.path.join(folder_path, files[0])
-        self.create_table_from_csv(sample_csv_path, table_name)
-
-        # 讀取並插入所有 CSV
+        self.migrate()
+        ingested = dict(self.cursor.execute(
+            f"SELECT file_name, sha256 FROM {MANIFEST_TABLE} WHERE table_name = ?", (table_name,)
+        ).fetchall())
+        pending = []
         for file in files:
-            file_path = os.path.join(folder_path, file)
-            df = pd.read_csv(file_path)
-            df.to_sql(table_name, self.conn, if_exists="append", index=False)
-            print(f"✅ {file} 已成功存入 {table_name} 資料表")
+            file_hash = _file_sha256(os.path.join(folder_path, file))
+            if ingested.get(file) != file_hash:
+                pending.append((file, file_hash))
+        skipped = len(files) - len(pending)
+        if not pending:
+            print(f"✅ {table_name}: {skipped} 個檔案皆已匯入，無需更新")
+            return []
+
+        columns = [col for col, _ in TABLE_SCHEMAS[table_name]["columns"]]
+        year_pos = columns.index("年")
+        period_pos = columns.index(TABLE_SCHEMAS[table_name]["primary_key"][2])
+        periods = set()
+        upsert_sql = self._upsert_sql(table_name)
+        manifest_sql = (
+            f"INSERT OR REPLACE INTO {MANIFEST_TABLE} "
+            "(table_name, file_name, sha256, row_count, ingested_at) VALUES (?, ?, ?, ?, ?)"
+        )
+        for start in range(0, len(pending), batch_size):
+            batch = pending[start:start + batch_size]
+            with self.conn:
+                for file, file_hash in batch:
+                    rows = self._read_rows(os.path.join(folder_path, file), table_name)
+                    self.conn.executemany(upsert_sql, rows)
+                    periods.update((int(row[year_pos]), int(row[period_pos])) for row in rows)
+                    self.conn.execute(manifest_sql, (
+                        table_name, file, file_hash, len(rows), datetime.now().isoformat(timespec="seconds")
+                    ))
+            print(f"✅ 已匯入 {start + len(batch)}/{len(pending)} 個檔案至 {table_name}")
+
+        self.cursor.execute(f"ANALYZE {_quote(table_name)}")
+        self.conn.commit()
+        print(f"✅ {table_name}: 匯入 {len(pending)} 個檔案，略過 {skipped} 個未變更檔案")
+        return sorted(periods)
+
+    def _write_table(self, table_name, df):
+        """以 df 取代整個資料表內容 (同一筆交易內先清空再寫入)"""
+        columns = [col for col, _ in _schema(table_name)["columns"]]
+        df = df[columns].astype(object)
+        df = df.where(df.notna(), None)
+        with self.conn:
+            self.conn.execute(f"DELETE FROM {_quote(table_name)}")
+            self.conn.executemany(self._upsert_sql(table_name), df.itertuples(index=False, name=None))
+
+    def metrics_are_empty(self):
+        """任一指標表或產業彙總表為空 (例如剛升級結構) 時回傳 True"""
+        return any(
+            self.cursor.execute(f"SELECT 1 FROM {_quote(table_name)} LIMIT 1").fetchone() is None
+            for table_name in list(METRIC_TABLE_SCHEMAS) + list(CUBE_TABLE_SCHEMAS)
+        )
+
+    def _latest_industries(self):
+        """各公司最新一期的產業別 (公司代號 → 產業別)，季報的同業百分位以此分組"""
+        rows = self.cursor.execute(
+            'SELECT "公司代號", "產業別", MAX("年" * 12 + "月") FROM "monthly_revenue" '
+            'WHERE "產業別" IS NOT NULL GROUP BY "公司代號"'
+        ).fetchall()
+        return pd.Series({code: industry for code, industry, _ in rows}, dtype=object)
+
+    def refresh_metrics(self, changed_periods=None):
+        """
+        以 metrics.py 的定義計算 YoY/MoM/QOQ、季度比率與產業同業百分位，
+        寫入 monthly_metrics / quarterly_metrics，並以同一份計算結果彙總產業 × 期間統計，
+        寫入 monthly_industry_cube / quarterly_industry_cube，前端直接讀取不必每次重算。
+          - changed_periods 為 None：全部重算
+          - changed_periods 為 {資料表: [(年, 月/季), ...]}：只重算受這些期間影響的指標列
+            (該期間本身與以它為比較基準的後續期間)，成本與異動量成正比而非與歷史長度成正比
+        """
+        self.migrate()
+        if changed_periods is None:
+            monthly_df = pd.read_sql_query('SELECT * FROM "monthly_revenue"', self.conn)
+            quarterly_df = pd.read_sql_query('SELECT * FROM "quarterly_report"', self.conn)
+            frames = dict(zip(DERIVED_TABLES, build_metric_frames(monthly_df, quarterly_df)))
+            for source_table, (metric_table, cube_table) in DERIVED_TABLES.items():
+                period_col = TABLE_SCHEMAS[source_table]["primary_key"][2]
+                metrics = frames[source_table][metric_table_columns(period_col)]
+                cube = industry_cube(frames[source_table], period_col)
+                self._write_table(metric_table, metrics)
+                self._write_table(cube_table, cube)
+                print(f"✅ 已更新 {metric_table} {len(metrics)} 列、{cube_table} {len(cube)} 列")
+            self.cursor.execute("ANALYZE")
+            self.conn.commit()
+            return
+
+        for source_table, (metric_table, cube_table) in DERIVED_TABLES.items():
+            periods = changed_periods.get(source_table)
+            if not periods:
+                continue
+            period_col = TABLE_SCHEMAS[source_table]["primary_key"][2]
+            targets = affected_periods(periods, period_col)
+            needed = source_periods(targets, period_col)
+            values_sql = ", ".join("(?, ?)" for _ in needed)
+            df = pd.read_sql_query(
+                f'SELECT * FROM {_quote(source_table)} WHERE ("年", {_quote(period_col)}) IN (VALUES {values_sql})',
+                self.conn, params=[value for period in needed for value in period]
+            )
+            industries = self._latest_industries() if source_table == "quarterly_report" else None
+            frame = recompute_period_frame(df, targets, period_col, industries)
+            rows = frame[metric_table_columns(period_col)]
+            rows = rows.astype(object).where(rows.notna(), None)
+            # 彙總表以期間為單位整批取代：先刪除受影響期間的列 (產業可能消失)，再寫入重算結果
+            cube = industry_cube(frame, period_col)
+            cube = cube.astype(object).where(cube.notna(), None)
+            target_sql = ", ".join("(?, ?)" for _ in targets)
+            with self.conn:
+                self.conn.executemany(self._upsert_sql(metric_table), rows.itertuples(index=False, name=None))
+                self.conn.execute(
+                    f'DELETE FROM {_quote(cube_table)} WHERE ("年", {_quote(period_col)}) IN (VALUES {target_sql})',
+                    [value for period in targets for value in period]
+                )
+                self.conn.executemany(self._upsert_sql(cube_table), cube.itertuples(index=False, name=None))
+            print(f"✅ 已增量更新 {metric_table}、{cube_table}：{len(targets)} 個期間、{len(rows)} 列")
+        self.cursor.execute("ANALYZE")
+        self.conn.commit()
 
     def close_connection(self):
         """關閉資料庫連線"""
@@ -67,9 +421,18 @@ def main():
     monthly_revenue_folder = "monthly_revenue_processed"
     quarterly_report_folder = "quarterly_report_processed"
 
+    # 建立或升級資料表結構
+    db_manager.migrate()
+
     # 將 CSV 存入資料庫
-    db_manager.insert_data_from_csv(monthly_revenue_folder, "monthly_revenue")
-    db_manager.insert_data_from_csv(quarterly_report_folder, "quarterly_report")
+    new_monthly = db_manager.insert_data_from_csv(monthly_revenue_folder, "monthly_revenue")
+    new_quarterly = db_manager.insert_data_from_csv(quarterly_report_folder, "quarterly_report")
+
+    # 指標表尚未建立時全部計算，否則只重算受新資料影響的期間
+    if db_manager.metrics_are_empty():
+        db_manager.refresh_metrics()
+    elif new_monthly or new_quarterly:
+        db_manager.refresh_metrics({"monthly_revenue": new_monthly, "quarterly_report": new_quarterly})
 
     # 關閉資料庫連線
     db_manager.close_connection()
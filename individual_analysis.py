@@ -2,86 +2,71 @@
 import streamlit as st
 import pandas as pd
 import plotly.graph_objects as go
+from data_access import data_version
+from companies import get_company_directory, company_selectbox
+from company_store import get_company_store
+from periods import PeriodView, period_range_selector, period_labels
+from metrics import (period_index, PEER_RANK_SUFFIX,
+                     MONTHLY_PEER_RANK_SOURCES, QUARTERLY_PEER_RANK_SOURCES)
+from charts import line_figure
+from instrumentation import instrument
 
-def individual_stock_analysis(monthly_df, quarterly_df):
+@instrument("頁面 各股分析")
+def individual_stock_analysis(data):
     st.header("各股分析")
-    # 以公司代號查詢，顯示「代號 - 公司名稱」
-    unique_companies = monthly_df[['公司代號', '公司名稱']].drop_duplicates().sort_values('公司代號')
-    unique_companies['display'] = unique_companies['公司代號'].astype(str) + " - " + unique_companies['公司名稱']
-    selected_display = st.selectbox("選擇公司 (請選擇公司代號)", unique_companies['display'].tolist())
-    selected_code = int(selected_display.split(" - ")[0])
+    # 以公司代號查詢，顯示「代號 - 公司名稱」，可先以代號或名稱搜尋
+    directory = get_company_directory(data_version())
+    selected_code = company_selectbox(directory, "選擇公司 (請選擇公司代號)", search=True, key="individual_company")
+    if selected_code is None:
+        return
+    selected_display = directory.label(selected_code)
     
-    monthly_company = monthly_df[monthly_df["公司代號"] == selected_code].copy()
-    quarterly_company = quarterly_df[quarterly_df["公司代號"] == selected_code].copy()
+    # 所選公司的資料 (含預先計算的指標欄位) 由依公司排序的快取取出，為連續區段的切片
+    monthly_company = get_company_store(data_version(), "monthly_revenue", data).company(selected_code)
+    quarterly_company = get_company_store(data_version(), "quarterly_report", data).company(selected_code)
     
-    # ── 月度資料時間區間篩選 ─────────────────────────
-    monthly_company = monthly_company.sort_values(['年', '月'])
-    available_periods = monthly_company[['年', '月']].drop_duplicates().sort_values(['年','月'])
-    available_periods['period_str'] = available_periods['年'].astype(str) + '-' + available_periods['月'].astype(str)
-    period_list = available_periods['period_str'].tolist()
-    if not period_list:
+    monthly_view = PeriodView(monthly_company, '月')
+    if not len(monthly_view.periods):
         st.error("無月度資料")
         return
-    col1, col2 = st.columns(2)
-    start_period = col1.selectbox("起始期間 (年-月)", period_list, index=0)
-    end_period = col2.selectbox("結束期間 (年-月)", period_list, index=len(period_list)-1)
-    def period_to_tuple(p):
-        parts = p.split('-')
-        return (int(parts[0]), int(parts[1]))
-    if period_to_tuple(start_period) > period_to_tuple(end_period):
-        st.error("起始期間必須早於或等於結束期間")
+    quarterly_view = PeriodView(quarterly_company, '季')
+    if not len(quarterly_view.periods):
+        st.error("無季度資料")
+        return
+    
+    # ── 時間區間篩選：月度與季度區間一起送出，調整選單時不重跑整頁 ─────────
+    with st.form("individual_period_filters"):
+        monthly_range = period_range_selector(monthly_view, "起始期間 (年-月)", "結束期間 (年-月)")
+        quarterly_range = period_range_selector(quarterly_view, "起始季度 (年 Q季)", "結束季度 (年 Q季)")
+        st.form_submit_button("套用期間")
+    if monthly_range is None or quarterly_range is None:
         return
-    start_tuple = period_to_tuple(start_period)
-    end_tuple = period_to_tuple(end_period)
-    monthly_company = monthly_company[monthly_company.apply(lambda row: (row['年'], row['月']) >= start_tuple and (row['年'], row['月']) <= end_tuple, axis=1)]
+    
+    monthly_company = monthly_view.slice(*monthly_range).copy()
     monthly_company['年月'] = monthly_company['年'].astype(str) + '-' + monthly_company['月'].astype(str)
     
     # 調整月度詳細數據欄位順序
     cols_order = ["年", "月", "公司代號", "公司名稱", "產業別", "營業收入-當月營收", "MoM", "YoY", "QOQ", "年月", "備註"]
     monthly_company = monthly_company[cols_order]
     
-    # ── 季報資料時間區間篩選 ─────────────────────────
-    quarterly_company = quarterly_company.sort_values(['年','季'])
-    available_quarters = quarterly_company[['年','季']].drop_duplicates().sort_values(['年','季'])
-    available_quarters['quarter_str'] = available_quarters['年'].astype(str) + " Q" + available_quarters['季'].astype(str)
-    quarter_list = available_quarters['quarter_str'].tolist()
-    if not quarter_list:
-        st.error("無季度資料")
-        return
-    col3, col4 = st.columns(2)
-    start_quarter = col3.selectbox("起始季度 (年 Q季)", quarter_list, index=0)
-    end_quarter = col4.selectbox("結束季度 (年 Q季)", quarter_list, index=len(quarter_list)-1)
-    def quarter_to_tuple(q):
-        parts = q.split(" Q")
-        return (int(parts[0]), int(parts[1]))
-    if quarter_to_tuple(start_quarter) > quarter_to_tuple(end_quarter):
-        st.error("起始季度必須早於或等於結束季度")
-        return
-    start_q_tuple = quarter_to_tuple(start_quarter)
-    end_q_tuple = quarter_to_tuple(end_quarter)
-    quarterly_company = quarterly_company[quarterly_company.apply(lambda row: (row['年'], row['季']) >= start_q_tuple and (row['年'], row['季']) <= end_q_tuple, axis=1)]
+    quarterly_company = quarterly_view.slice(*quarterly_range).copy()
     quarterly_company['季期'] = quarterly_company['年'].astype(str) + " Q" + quarterly_company['季'].astype(str)
     
-    # 分頁顯示：月度與季度分析
-    tabs = st.tabs(["月度營收分析", "季度財報分析"])
+    # 分頁顯示：月度與季度分析、產業同業位置
+    tabs = st.tabs(["月度營收分析", "季度財報分析", "同業位置"])
     
     with tabs[0]:
+        # 長期間的資料點數過多時，line_figure 會降採樣並改用 WebGL 繪製
+        periods = period_index(monthly_company['年'], monthly_company['月'], '月')
         st.subheader("營收折線圖")
-        fig_revenue = go.Figure()
-        fig_revenue.add_trace(go.Scatter(x=monthly_company['年月'], y=monthly_company["營業收入-當月營收"],
-                                         mode='lines+markers', name="營收"))
-        fig_revenue.update_layout(title=f"{selected_display} - 營收趨勢",
-                                  xaxis_title="年月", yaxis_title="營收")
+        fig_revenue = line_figure([("營收", periods, monthly_company["營業收入-當月營收"])], '月',
+                                  title=f"{selected_display} - 營收趨勢", xaxis_title="年月", yaxis_title="營收")
         st.plotly_chart(fig_revenue, use_container_width=True)
         
         st.subheader("YoY 與 MoM 趨勢")
-        fig_growth = go.Figure()
-        fig_growth.add_trace(go.Scatter(x=monthly_company['年月'], y=monthly_company["YoY"],
-                                        mode='lines+markers', name="YoY (%)"))
-        fig_growth.add_trace(go.Scatter(x=monthly_company['年月'], y=monthly_company["MoM"],
-                                        mode='lines+markers', name="MoM (%)"))
-        fig_growth.update_layout(title=f"{selected_display} - YoY 與 MoM 趨勢",
-                                 xaxis_title="年月", yaxis_title="百分比 (%)")
+        fig_growth = line_figure([("YoY (%)", periods, monthly_company["YoY"]),
+                                  ("MoM (%)", periods, monthly_company["MoM"])], '月',
+                                 title=f"{selected_display} - YoY 與 MoM 趨勢", xaxis_title="年月", yaxis_title="百分比 (%)")
         st.plotly_chart(fig_growth, use_container_width=True)
         
         st.subheader("月度詳細數據")
@@ -94,14 +79,67 @@ def individual_stock_analysis(monthly_df, quarterly_df):
                         '流動比率_QoQ', '負債比率_QoQ', '毛利率_QoQ', 'EPS_QoQ']
         st.dataframe(quarterly_company[cols_to_show].reset_index(drop=True))
         st.subheader("季度指標圖表")
-        metric_options = st.multiselect("選擇要繪製的指標", 
-                                        options=['資產總計(額)', '負債總計(額)', '流動資產', '非流動資產', 
-                                                 '流動負債', '非流動負債', '流動比率', '負債比率', '毛利率', 'EPS'],
-                                        default=['資產總計(額)', '負債總計(額)'])
-        if metric_options:
-            fig_q = go.Figure()
-            for metric in metric_options:
-                fig_q.add_trace(go.Bar(x=quarterly_company['季期'], y=quarterly_company[metric], name=metric))
-            fig_q.update_layout(title=f"{selected_display} - 季度指標比較",
-                                barmode='group', xaxis_title="季期")
-            st.plotly_chart(fig_q, use_container_width=True)
+        _quarterly_chart(quarterly_company, selected_display)
+    
+    with tabs[2]:
+        _peer_panel({"月營收": monthly_view.slice(*monthly_range), "季財報": quarterly_company},
+                    directory.industry(selected_code))
+
+@st.fragment
+def _quarterly_chart(quarterly_company, selected_display):
+    """季度指標圖表；選擇指標只重跑此區塊，不重新載入資料"""
+    metric_options = st.multiselect("選擇要繪製的指標", 
+                                    options=['資產總計(額)', '負債總計(額)', '流動資產', '非流動資產', 
+                                             '流動負債', '非流動負債', '流動比率', '負債比率', '毛利率', 'EPS'],
+                                    default=['資產總計(額)', '負債總計(額)'])
+    if metric_options:
+        fig_q = go.Figure()
+        for metric in metric_options:
+            fig_q.add_trace(go.Bar(x=quarterly_company['季期'], y=quarterly_company[metric], name=metric))
+        fig_q.update_layout(title=f"{selected_display} - 季度指標比較",
+                            barmode='group', xaxis_title="季期")
+        st.plotly_chart(fig_q, use_container_width=True)
+
+# 同業位置面板：資料來源 → (期間欄位, 要顯示百分位的指標)
+PEER_SOURCES = {"月營收": ('月', MONTHLY_PEER_RANK_SOURCES), "季財報": ('季', QUARTERLY_PEER_RANK_SOURCES)}
+
+@st.fragment
+def _peer_panel(frames, industry):
+    """
+    所選公司在同產業中的位置：指定期間各指標的數值與產業同業百分位 (0~100)。
+    百分位於資料匯入時預先計算 (metrics.add_peer_ranks)，此處只讀取所選公司的欄位。
+    """
+    st.subheader("產業同業位置")
+    if not industry:
+        st.info("此公司沒有產業別資料")
+        return
+    dataset = st.radio("資料來源", tuple(PEER_SOURCES), horizontal=True, key="peer_dataset")
+    period_col, sources = PEER_SOURCES[dataset]
+    df = frames[dataset]
+    rank_cols = [col + PEER_RANK_SUFFIX for col in sources]
+    if any(col not in df.columns for col in rank_cols):
+        st.info("資料庫尚未建立同業百分位，請執行 data_pipeline 更新指標表")
+        return
+    if df.empty:
+        st.info("所選區間沒有資料")
+        return
+    periods = period_index(df['年'], df[period_col], period_col)
+    labels = period_labels(periods, period_col)
+    pos = st.selectbox("期間", range(len(df)), index=len(df) - 1, format_func=lambda i: labels[i], key="peer_period")
+    row = df.iloc[pos]
+    table = pd.DataFrame({
+        "指標": sources,
+        "數值": [row[col] for col in sources],
+        "產業百分位": [row[col] for col in rank_cols],
+    })
+    st.caption(f"{industry}，{labels[pos]}；百分位越高表示在同產業中數值越大")
+    st.dataframe(table, column_config={
+        "數值": st.column_config.NumberColumn(format="%.2f"),
+        "產業百分位": st.column_config.ProgressColumn(min_value=0, max_value=100, format="%.0f"),
+    })
+    ranked = table.dropna(subset=["產業百分位"])
+    if not ranked.empty:
+        fig = go.Figure(go.Bar(x=ranked["產業百分位"], y=ranked["指標"], orientation='h'))
+        fig.update_layout(title=f"{labels[pos]} 於{industry}的百分位", xaxis_title="產業百分位",
+                          xaxis_range=[0, 100], yaxis_autorange="reversed")
+        st.plotly_chart(fig, use_container_width=True)
@@ -0,0 +1,91 @@
+# industry_analysis.py
+import streamlit as st
+import numpy as np
+import pandas as pd
+import plotly.express as px
+from data_access import PERIOD_COLUMN, load_industry_cube
+from metrics import period_index, ALL_INDUSTRIES, CUBE_METRICS, CUBE_HIST_EDGES, CUBE_HIST_BINS
+from periods import period_labels
+from charts import line_figure
+from tables import number_formats
+from instrumentation import instrument
+
+# 資料來源 → 資料表
+CUBE_DATASETS = {"月營收": "monthly_revenue", "季財報": "quarterly_report"}
+# 可繪製趨勢的統計量
+TREND_STATS = ("中位數", "平均", "總和", "P10", "P25", "P75", "P90", "家數", "正值比例")
+# 橫斷面表格顯示的欄位
+TABLE_COLUMNS = ["產業別", "家數", "平均", "P10", "P25", "中位數", "P75", "P90", "正值比例", "總和"]
+
+def bin_labels(edges):
+    """分布區間的顯示字串：< 切點1、切點1 ~ 切點2、…、≥ 最後切點"""
+    edges = [f"{edge:g}" for edge in edges]
+    return [f"< {edges[0]}"] + [f"{lo} ~ {hi}" for lo, hi in zip(edges, edges[1:])] + [f"≥ {edges[-1]}"]
+
+@instrument("頁面 產業分析")
+def industry_analysis(data):
+    """
+    產業 × 期間彙總分析：只讀取匯入時預先計算的產業彙總表 (load_industry_cube)，
+    不載入公司層級資料，data 不會被取用。
+    """
+    st.header("產業分析")
+    dataset_option = st.radio("選擇資料來源", tuple(CUBE_DATASETS), horizontal=True)
+    table = CUBE_DATASETS[dataset_option]
+    period_col = PERIOD_COLUMN[table]
+    cube = load_industry_cube(table)
+    if cube.empty:
+        st.error("尚無產業彙總資料，請先執行 data_pipeline/insert_data_to_DB.py")
+        return
+
+    available = set(cube["指標"].astype(str))
+    metrics = [m for m in CUBE_METRICS[period_col] if m in available]
+    industries = sorted(set(cube["產業別"].astype(str)) - {ALL_INDUSTRIES})
+    col1, col2 = st.columns(2)
+    metric = col1.selectbox("選擇指標", metrics)
+    stat = col2.selectbox("統計量", TREND_STATS)
+    selected = st.multiselect("選擇產業", [ALL_INDUSTRIES] + industries, default=[ALL_INDUSTRIES])
+
+    rows = cube[cube["指標"] == metric]
+    keys = period_index(rows["年"], rows[period_col], period_col)
+    industry_of = rows["產業別"].astype(str).to_numpy()
+
+    # 各產業統計量的時間序列
+    if selected:
+        values = rows[stat].to_numpy(dtype="float64", na_value=np.nan)
+        series = [(name, keys[industry_of == name], values[industry_of == name]) for name in selected]
+        fig = line_figure(series, period_col, title=f"{metric} 各產業{stat}",
+                          xaxis_title="期間", yaxis_title=stat)
+        st.plotly_chart(fig, use_container_width=True)
+
+    _cross_section(rows, keys, metric, period_col, selected)
+
+@st.fragment
+def _cross_section(rows, keys, metric, period_col, selected):
+    """單一期間所有產業的統計量與所選產業的分布"""
+    periods = np.unique(keys).tolist()
+    period = st.selectbox("橫斷面期間", periods, index=len(periods) - 1,
+                          format_func=lambda p: period_labels([p], period_col)[0], key="industry_period")
+    current = rows[keys == period]
+    table_df = current[TABLE_COLUMNS].copy()
+    table_df["產業別"] = table_df["產業別"].astype(str)
+    table_df = table_df.sort_values("中位數", ascending=False, na_position="last").reset_index(drop=True)
+    st.subheader(f"{period_labels([period], period_col)[0]} 各產業 {metric}")
+    st.dataframe(table_df, column_config=number_formats(table_df))
+
+    if not selected:
+        return
+    bins = [f"分布_{i}" for i in range(1, CUBE_HIST_BINS + 1)]
+    picked = current[current["產業別"].astype(str).isin(selected)]
+    counts = picked[bins].to_numpy(dtype="float64", na_value=0.0)
+    totals = counts.sum(axis=1, keepdims=True)
+    # 以各產業家數換算比例，產業規模不同也能比較分布形狀
+    with np.errstate(divide="ignore", invalid="ignore"):
+        shares = np.where(totals > 0, counts / totals * 100, 0.0)
+    hist_df = pd.DataFrame({
+        "產業別": np.repeat(picked["產業別"].astype(str).to_numpy(), CUBE_HIST_BINS),
+        "區間": bin_labels(CUBE_HIST_EDGES[metric]) * len(picked),
+        "比例(%)": shares.ravel(),
+    })
+    fig = px.bar(hist_df, x="區間", y="比例(%)", color="產業別", barmode="group",
+                 title=f"{metric} 分布")
+    st.plotly_chart(fig, use_container_width=True)
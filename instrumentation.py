@@ -0,0 +1,215 @@
+# instrumentation.py
+import os
+import time
+import logging
+import threading
+import functools
+import tracemalloc
+from collections import deque
+from contextlib import contextmanager
+from logging.handlers import RotatingFileHandler
+import numpy as np
+import pandas as pd
+
+# 設為 0 時停用所有計時 (stage / instrument 直接執行，不做任何紀錄)
+ENABLED = os.environ.get("FINANCIAL_INSTRUMENTATION", "1") != "0"
+# 設為 1 時啟動 tracemalloc 記錄各階段的記憶體峰值 (會拖慢執行，預設關閉，也可在除錯面板開啟)
+TRACE_MEMORY = os.environ.get("FINANCIAL_TRACE_MEMORY", "0") == "1"
+# 效能紀錄檔 (每個檔案 LOG_MAX_BYTES，保留 LOG_BACKUPS 個舊檔)
+LOG_PATH = os.environ.get("FINANCIAL_PERF_LOG", os.path.join("logs", "performance.log"))
+LOG_MAX_BYTES = 1024 * 1024
+LOG_BACKUPS = 3
+# 每個階段只保留最近幾筆耗時計算 p50 / p95 (較舊的紀錄會被捨棄，完整紀錄見紀錄檔)
+HISTORY_SIZE = 1000
+
+_lock = threading.Lock()
+_history = {}
+_local = threading.local()
+_logger = None
+
+
+class StageRecord:
+    """單一階段的紀錄；rows 可在 with 區塊內設定 (例如 record.rows = len(df))"""
+    __slots__ = ("name", "depth", "rows", "seconds", "peak_bytes", "_start_bytes", "_max_bytes")
+
+    def __init__(self, name, depth, rows=None):
+        self.name = name
+        self.depth = depth
+        self.rows = rows
+        self.seconds = None
+        self.peak_bytes = None
+        self._start_bytes = 0
+        self._max_bytes = 0
+
+
+def _get_logger():
+    """建立輪替的效能紀錄檔；無法寫入 (例如唯讀環境) 時只保留記憶體中的統計"""
+    global _logger
+    if _logger is None:
+        logger = logging.getLogger("financial_dashboard.performance")
+        logger.setLevel(logging.INFO)
+        logger.propagate = False
+        try:
+            os.makedirs(os.path.dirname(LOG_PATH) or ".", exist_ok=True)
+            handler = RotatingFileHandler(LOG_PATH, maxBytes=LOG_MAX_BYTES, backupCount=LOG_BACKUPS,
+                                          encoding="utf-8")
+            handler.setFormatter(logging.Formatter("%(asctime)s %(message)s"))
+            logger.addHandler(handler)
+        except OSError as e:
+            print(f"⚠️ 無法寫入效能紀錄檔 {LOG_PATH}: {e}")
+            logger.addHandler(logging.NullHandler())
+        _logger = logger
+    return _logger
+
+
+def _stack():
+    if not hasattr(_local, "stack"):
+        _local.stack = []
+        _local.run = []
+    return _local.stack
+
+
+def begin_run():
+    """開始一次新的頁面執行：清空本執行緒 (目前 session) 的本次紀錄，供除錯面板顯示"""
+    _stack()
+    _local.run = []
+
+
+def current_run():
+    """本次執行已完成的階段紀錄 (依開始順序，巢狀階段的 depth 較大)"""
+    _stack()
+    return [record for record in _local.run if record.seconds is not None]
+
+
+def set_memory_tracing(enabled):
+    """
+    開啟或關閉 tracemalloc (全程序共用)。
+    峰值是全程序只有一份，各 session 的 stage 會互相重設 (reset_peak)，
+    多個 session 同時執行時記錄到的峰值不準確，只在單一使用中 session 時具參考價值。
+    """
+    if enabled and not tracemalloc.is_tracing():
+        tracemalloc.start()
+    elif not enabled and tracemalloc.is_tracing():
+        tracemalloc.stop()
+
+
+def _record(record):
+    with _lock:
+        _history.setdefault(record.name, deque(maxlen=HISTORY_SIZE)).append(
+            (record.seconds, record.rows, record.peak_bytes))
+    rows = "" if record.rows is None else f" rows={record.rows}"
+    peak = "" if record.peak_bytes is None else f" peak_mb={record.peak_bytes / 1024 ** 2:.2f}"
+    _get_logger().info(f"stage={record.name} ms={record.seconds * 1000:.2f}{rows}{peak}")
+
+
+@contextmanager
+def stage(name, rows=None):
+    """
+    記錄一個階段的耗時 (wall time)、資料列數與記憶體峰值 (tracemalloc 開啟時)：
+        with stage("load_table") as record:
+            df = ...
+            record.rows = len(df)
+    階段可以巢狀；tracemalloc 的峰值只有一份，內層階段重設前會先把目前峰值記到外層。
+    其他 session 的階段也會重設峰值，記憶體峰值只在單一 session 執行時準確 (見 set_memory_tracing)。
+    """
+    if not ENABLED:
+        yield StageRecord(name, 0, rows)
+        return
+    stack = _stack()
+    record = StageRecord(name, len(stack), rows)
+    tracing = tracemalloc.is_tracing()
+    if tracing:
+        current, peak = tracemalloc.get_traced_memory()
+        if stack:
+            stack[-1]._max_bytes = max(stack[-1]._max_bytes, peak)
+        tracemalloc.reset_peak()
+        record._start_bytes = record._max_bytes = current
+    stack.append(record)
+    _local.run.append(record)
+    start = time.perf_counter()
+    try:
+        yield record
+    finally:
+        record.seconds = time.perf_counter() - start
+        stack.pop()
+        if tracing and tracemalloc.is_tracing():
+            peak = max(record._max_bytes, tracemalloc.get_traced_memory()[1])
+            record.peak_bytes = peak - record._start_bytes
+            if stack:
+                stack[-1]._max_bytes = max(stack[-1]._max_bytes, peak)
+        _record(record)
+
+
+def _row_count(result):
+    if isinstance(result, (pd.DataFrame, pd.Series, np.ndarray)):
+        return len(result)
+    return None
+
+
+def instrument(name=None):
+    """
+    裝飾器版本的 stage：以函式名稱 (或 name) 為階段名稱，
+    回傳值為 DataFrame / Series / ndarray 時記錄其列數。
+    """
+    def decorator(func):
+        stage_name = name or func.__qualname__
+
+        @functools.wraps(func)
+        def wrapper(*args, **kwargs):
+            with stage(stage_name) as record:
+                result = func(*args, **kwargs)
+                record.rows = _row_count(result)
+            return result
+        return wrapper
+    return decorator
+
+
+def summary():
+    """
+    各階段最近 HISTORY_SIZE 筆紀錄的統計：次數、p50 / p95 / 最大耗時 (ms)、最近一次列數與記憶體峰值 p95 (MB)。
+    更早的紀錄只留在紀錄檔 (LOG_PATH)。
+    """
+    with _lock:
+        history = {name: list(records) for name, records in _history.items()}
+    rows = []
+    for name, records in history.items():
+        seconds = np.array([r[0] for r in records]) * 1000
+        peaks = [r[2] for r in records if r[2] is not None]
+        rows.append({
+            "階段": name,
+            "次數": len(records),
+            "p50 (ms)": float(np.percentile(seconds, 50)),
+            "p95 (ms)": float(np.percentile(seconds, 95)),
+            "最大 (ms)": float(seconds.max()),
+            "最近列數": records[-1][1],
+            "記憶體峰值 p95 (MB)": float(np.percentile(peaks, 95)) / 1024 ** 2 if peaks else None,
+        })
+    columns = ["階段", "次數", "p50 (ms)", "p95 (ms)", "最大 (ms)", "最近列數", "記憶體峰值 p95 (MB)"]
+    return pd.DataFrame(rows, columns=columns).sort_values("p95 (ms)", ascending=False, ignore_index=True)
+
+
+def debug_panel():
+    """側邊欄的除錯面板 (預設收合)：本次執行各階段的耗時，以及各階段最近 HISTORY_SIZE 筆的 p50 / p95"""
+    import streamlit as st
+
+    if not ENABLED or not st.sidebar.checkbox("顯示效能資訊", key="debug_performance"):
+        return
+    tracing = st.sidebar.checkbox("記錄記憶體峰值 (tracemalloc)", value=tracemalloc.is_tracing(),
+                                  key="debug_trace_memory",
+                                  help="全程序共用；多個使用者同時操作時峰值會互相干擾")
+    set_memory_tracing(tracing)
+    with st.sidebar.expander("本次執行", expanded=True):
+        run = pd.DataFrame([{
+            "階段": "　" * r.depth + r.name,
+            "ms": r.seconds * 1000,
+            "列數": r.rows,
+            "記憶體峰值 (MB)": None if r.peak_bytes is None else r.peak_bytes / 1024 ** 2,
+        } for r in current_run()], columns=["階段", "ms", "列數", "記憶體峰值 (MB)"])
+        st.dataframe(run, hide_index=True)
+    with st.sidebar.expander(f"最近 {HISTORY_SIZE} 筆統計 (p50 / p95)"):
+        st.dataframe(summary(), hide_index=True)
+        st.caption(f"紀錄檔：{LOG_PATH}")
+
+
+if TRACE_MEMORY:
+    set_memory_tracing(True)
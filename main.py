@@ -1,28 +1,37 @@
 # main.py
+import importlib
 import streamlit as st
-from data_access import load_data
-from metrics import calculate_monthly_metrics, calculate_monthly_qoq, calculate_quarterly_metrics
-from individual_analysis import individual_stock_analysis
-from multi_company_analysis import multi_company_analysis
-from overall_sorting import overall_sorting
+from data_access import Datasets
+from instrumentation import stage, begin_run, debug_panel
+
+# 頁面註冊表：選單名稱 → (模組, 函式, 頁面需要的資料表)
+# 選到該頁時才 import 模組 (連同 plotly 等繪圖套件)，資料表也在頁面實際取用時才載入
+PAGES = {
+    "各股分析": ("individual_analysis", "individual_stock_analysis", ("monthly_revenue", "quarterly_report")),
+    "多公司分析": ("multi_company_analysis", "multi_company_analysis", ("monthly_revenue", "quarterly_report")),
+    "整體排序": ("overall_sorting", "overall_sorting", ("monthly_revenue", "quarterly_report")),
+    "選股篩選": ("stock_screener", "stock_screener", ("monthly_revenue", "quarterly_report")),
+    # 產業分析只讀取預先彙總的產業 × 期間小表，不需要載入公司層級資料表
+    "產業分析": ("industry_analysis", "industry_analysis", ()),
+}
+
+def run_page(name):
+    module_name, func_name, tables = PAGES[name]
+    with stage(f"匯入 {module_name}"):
+        page = getattr(importlib.import_module(module_name), func_name)
+    # 指標欄位已於資料匯入時計算，隨資料一併載入
+    page(Datasets(tables))
 
 def main():
     st.title("Financial Analysis Dashboard")
-    st.markdown("本應用程式從 SQLite 資料庫讀取數據，提供各股分析、多公司分析與整體排序功能。")
-    
-    menu = st.sidebar.radio("選擇功能", ("各股分析", "多公司分析", "整體排序"))
-    
-    monthly_df, quarterly_df = load_data()
-    monthly_df = calculate_monthly_metrics(monthly_df)
-    monthly_df = calculate_monthly_qoq(monthly_df)
-    quarterly_df = calculate_quarterly_metrics(quarterly_df)
-    
-    if menu == "各股分析":
-        individual_stock_analysis(monthly_df, quarterly_df)
-    elif menu == "多公司分析":
-        multi_company_analysis(monthly_df, quarterly_df)
-    elif menu == "整體排序":
-        overall_sorting(monthly_df, quarterly_df)
+    st.markdown("本應用程式從 SQLite 資料庫讀取數據，提供各股分析、多公司分析、整體排序、選股篩選與產業分析功能。")
+
+    menu = st.sidebar.radio("選擇功能", tuple(PAGES))
+    # 各階段耗時記錄於 instrumentation，勾選側邊欄「顯示效能資訊」可檢視
+    begin_run()
+    with stage("main"):
+        run_page(menu)
+    debug_panel()
 
 if __name__ == '__main__':
     main()
@@ -1,51 +1,319 @@
 # metrics.py
+import numpy as np
 import pandas as pd
+from instrumentation import instrument
 
-def calculate_monthly_metrics(df):
+# 於資料匯入時預先計算、存入 monthly_metrics / quarterly_metrics 的指標欄位
+MONTHLY_METRIC_COLUMNS = ['YoY', 'MoM', 'QOQ']
+QUARTERLY_METRIC_COLUMNS = ['流動比率', '負債比率', '毛利率', 'EPS',
+                            '流動比率_QoQ', '負債比率_QoQ', '毛利率_QoQ', 'EPS_QoQ', 'YoY', 'MOM']
+
+# 產業同業百分位：各指標在同一 (產業別, 期間) 內的百分位排名 (0~100)，欄位名稱為 指標 + PEER_RANK_SUFFIX
+PEER_RANK_SUFFIX = '_產業百分位'
+MONTHLY_PEER_RANK_SOURCES = ['營業收入-當月營收'] + MONTHLY_METRIC_COLUMNS
+QUARTERLY_PEER_RANK_SOURCES = QUARTERLY_METRIC_COLUMNS
+MONTHLY_PEER_RANK_COLUMNS = [col + PEER_RANK_SUFFIX for col in MONTHLY_PEER_RANK_SOURCES]
+QUARTERLY_PEER_RANK_COLUMNS = [col + PEER_RANK_SUFFIX for col in QUARTERLY_PEER_RANK_SOURCES]
+
+# 產業 × 期間彙總表 (industry_cube)：彙總的指標、分位數與分布區間的切點
+ALL_INDUSTRIES = '全市場'
+CUBE_METRICS = {
+    '月': ['營業收入-當月營收', 'YoY', 'MoM'],
+    '季': ['資產總計(額)', '營業收入', '毛利率', '負債比率', 'EPS', 'YoY'],
+}
+_AMOUNT_EDGES = [1e4, 1e5, 1e6, 1e7, 1e8, 1e9, 1e10]
+_GROWTH_EDGES = [-50, -20, -10, 0, 10, 20, 50]
+CUBE_HIST_EDGES = {
+    '營業收入-當月營收': _AMOUNT_EDGES,
+    '資產總計(額)': _AMOUNT_EDGES,
+    '營業收入': _AMOUNT_EDGES,
+    'YoY': _GROWTH_EDGES,
+    'MoM': _GROWTH_EDGES,
+    '毛利率': [0, 10, 20, 30, 40, 50, 60],
+    '負債比率': [0.2, 0.3, 0.4, 0.5, 0.6, 0.7, 0.8],
+    'EPS': [-1, 0, 0.5, 1, 2, 5, 10],
+}
+CUBE_HIST_BINS = 8
+CUBE_QUANTILES = [0.1, 0.25, 0.5, 0.75, 0.9]
+CUBE_QUANTILE_COLUMNS = ['P10', 'P25', '中位數', 'P75', 'P90']
+CUBE_STAT_COLUMNS = (['家數', '總和', '平均'] + CUBE_QUANTILE_COLUMNS + ['正值比例']
+                     + [f'分布_{i}' for i in range(1, CUBE_HIST_BINS + 1)])
+
+# 每年的期數，期間索引 = 年 * 每年期數 + 月/季
+PERIODS_PER_YEAR = {'月': 12, '季': 4}
+
+# 成長率定義：(輸出欄位, 來源欄位, 往前幾期)
+MONTHLY_GROWTH_SPECS = [
+    ('YoY', '營業收入-當月營收', 12),
+    ('MoM', '營業收入-當月營收', 1),
+    ('QOQ', '營業收入-當月營收', 3),
+]
+QUARTERLY_GROWTH_SPECS = [
+    ('流動比率_QoQ', '流動比率', 1),
+    ('負債比率_QoQ', '負債比率', 1),
+    ('毛利率_QoQ', '毛利率', 1),
+    ('EPS_QoQ', 'EPS', 1),
+    # 以資產總計(額)為例計算 YOY
+    ('YoY', '資產總計(額)', 4),
+    # 將季度 MOM 亦定義為前一季變化
+    ('MOM', '資產總計(額)', 1),
+]
+
+# 組合鍵 = 公司代號 * _KEY_SPAN + 期間索引，期間索引需小於 _KEY_SPAN
+_KEY_SPAN = 1_000_000
+
+
+def period_index(years, periods, period_col):
+    """
+    整數期間索引：月資料為 年*12+月，季資料為 年*4+季。
+    相鄰月份 (含跨年) 的索引恰好相差 1，可直接以減法找出前 N 期。
     """
-    計算月度資料的 YoY（同比）與 MOM（環比）
-      - YoY：以去年同月比較 (periods=12)
-      - MOM：以上個月比較 (periods=1)
+    years = np.asarray(years, dtype='int64')
+    periods = np.asarray(periods, dtype='int64')
+    return years * PERIODS_PER_YEAR[period_col] + periods
+
+
+def index_to_periods(index, period_col):
+    """period_index 的反運算，回傳 [(年, 月/季), ...]"""
+    per_year = PERIODS_PER_YEAR[period_col]
+    index = np.asarray(index, dtype='int64')
+    return [(int(i), int(p)) for i, p in zip((index - 1) // per_year, (index - 1) % per_year + 1)]
+
+
+def _sorted_keys(df, period_col):
+    """依 公司代號、期間 排序一次，回傳排序後的資料與組合鍵"""
+    codes = df['公司代號'].to_numpy(dtype='int64', na_value=-1)
+    index = period_index(df['年'].to_numpy(dtype='int64', na_value=-1),
+                         df[period_col].to_numpy(dtype='int64', na_value=-1), period_col)
+    keys = codes * _KEY_SPAN + index
+    order = np.argsort(keys, kind='stable')
+    return df.take(order), keys[order]
+
+
+def lag_positions(keys, lag):
     """
-    df = df.sort_values(['公司代號', '年', '月']).copy()
-    df['YoY'] = df.groupby('公司代號')['營業收入-當月營收'].pct_change(periods=12) * 100
-    df['MoM'] = df.groupby('公司代號')['營業收入-當月營收'].pct_change(periods=1) * 100
+    每列往前 lag 期 (同一公司) 的列位置，找不到該期時為 -1。
+    以期間索引精確對齊，缺少的月份不會讓比較對象錯位。
+    """
+    target = keys - lag
+    pos = np.searchsorted(keys, target)
+    pos_clipped = np.minimum(pos, len(keys) - 1)
+    found = (pos < len(keys)) & (keys[pos_clipped] == target)
+    return np.where(found, pos_clipped, -1)
+
+
+def growth_from_positions(values, positions):
+    """與 positions 指到的列相比的變化率 (%)，無對應期間時為 NaN"""
+    prev = np.where(positions >= 0, values[np.maximum(positions, 0)], np.nan)
+    with np.errstate(divide='ignore', invalid='ignore'):
+        return (values / prev - 1) * 100
+
+
+def _add_growth(df, keys, specs):
+    """在已排序的 df 上加入成長率欄位，相同期數的對齊位置共用"""
+    positions = {}
+    for output, source, lag in specs:
+        if lag not in positions:
+            positions[lag] = lag_positions(keys, lag)
+        values = df[source].to_numpy(dtype='float64', na_value=np.nan)
+        df[output] = growth_from_positions(values, positions[lag])
     return df
 
+
+def apply_growth(df, period_col, specs):
+    """
+    依 specs 一次算出所有成長率欄位：只排序一次 (產生唯一一份副本)，
+    每個輸出欄位為一次向量運算。
+    """
+    df, keys = _sorted_keys(df, period_col)
+    return _add_growth(df, keys, specs)
+
+
+@instrument()
+def calculate_monthly_metrics(df):
+    """
+    計算月度資料的 YoY（同比）、MOM（環比）與 QoQ（以3個月為一季比較）
+      - YoY：與去年同月比較
+      - MOM：與上個月比較
+      - QoQ：與前三個月比較
+    比較對象以 年*12+月 精確對齊，缺少的月份不會造成錯位 (該列結果為 NaN)。
+    """
+    return apply_growth(df, '月', MONTHLY_GROWTH_SPECS)
+
 def calculate_monthly_qoq(df):
     """
     計算月度資料的 QoQ（以3個月為一季比較）
-      - QoQ：以前三個月比較 (periods=3)
+      - QoQ：與前三個月比較
+    calculate_monthly_metrics 已一併計算 QOQ，此函式保留供只需 QOQ 時使用。
     """
-    df = df.sort_values(['公司代號', '年', '月']).copy()
-    df['QOQ'] = df.groupby('公司代號')['營業收入-當月營收'].pct_change(periods=3) * 100
-    return df
+    return apply_growth(df, '月', [spec for spec in MONTHLY_GROWTH_SPECS if spec[0] == 'QOQ'])
 
-def calculate_quarterly_metrics(df):
+def add_quarterly_ratios(df):
     """
-    計算季度資料的各項財務比率與變化：
+    於 df 上直接加入季度財務比率欄位：
       - 流動比率 = 流動資產 / 流動負債
       - 負債比率 = 負債總計(額) / 資產總計(額)
       - 毛利率 = (營業毛利（毛損） / 營業收入) * 100%
       - EPS = 基本每股盈餘（元）
-      
-    並以各公司依季度計算：
-      - QoQ：前一季變化 (periods=1)
-      - YOY：以去年同季度比較 (periods=4)
-      - 此處 MOM 同 QoQ 以前一季計算（季度資料無月比概念）
     """
-    df = df.sort_values(['公司代號', '年', '季']).copy()
     df['流動比率'] = df['流動資產'] / df['流動負債']
     df['負債比率'] = df['負債總計(額)'] / df['資產總計(額)']
     df['毛利率'] = df['營業毛利（毛損）'] / df['營業收入'] * 100
     df['EPS'] = df['基本每股盈餘（元）']
-    
-    df['流動比率_QoQ'] = df.groupby('公司代號')['流動比率'].pct_change(periods=1) * 100
-    df['負債比率_QoQ'] = df.groupby('公司代號')['負債比率'].pct_change(periods=1) * 100
-    df['毛利率_QoQ'] = df.groupby('公司代號')['毛利率'].pct_change(periods=1) * 100
-    df['EPS_QoQ'] = df.groupby('公司代號')['EPS'].pct_change(periods=1) * 100
-    # 以資產總計(額)為例計算 YOY
-    df['YoY'] = df.groupby('公司代號')['資產總計(額)'].pct_change(periods=4) * 100
-    # 將季度 MOM 亦定義為前一季變化
-    df['MOM'] = df.groupby('公司代號')['資產總計(額)'].pct_change(periods=1) * 100
     return df
+
+@instrument()
+def calculate_quarterly_metrics(df):
+    """
+    計算季度資料的各項財務比率 (見 add_quarterly_ratios) 與變化：
+      - QoQ：與前一季比較
+      - YOY：與去年同季度比較
+      - 此處 MOM 同 QoQ 以前一季計算（季度資料無月比概念）
+    比較對象以 年*4+季 精確對齊。
+    """
+    df, keys = _sorted_keys(df, '季')
+    df = add_quarterly_ratios(df)
+    return _add_growth(df, keys, QUARTERLY_GROWTH_SPECS)
+
+def latest_industries(monthly_df):
+    """各公司最新一期的產業別 (index 為公司代號)，供沒有產業別欄位的季報資料對照"""
+    df = monthly_df[['公司代號', '年', '月', '產業別']].dropna(subset=['產業別'])
+    df = df.sort_values(['公司代號', '年', '月'])
+    return df.drop_duplicates('公司代號', keep='last').set_index('公司代號')['產業別'].astype(object)
+
+@instrument()
+def add_peer_ranks(df, period_col, industries=None):
+    """
+    於 df 上加入產業同業百分位欄位 (MONTHLY_ / QUARTERLY_PEER_RANK_COLUMNS)：
+    以 groupby([產業別, 年, 月/季]).rank(pct=True) 一次算出所有指標，值為 0~100，
+    數值越大排名越前；缺值、無窮大或沒有產業別的列為 NaN。
+      - industries：公司代號 → 產業別 (df 沒有產業別欄位時使用，例如季報)
+    """
+    sources = MONTHLY_PEER_RANK_SOURCES if period_col == '月' else QUARTERLY_PEER_RANK_SOURCES
+    if '產業別' in df.columns:
+        industry = df['產業別'].astype(object)
+    elif industries is not None:
+        industry = df['公司代號'].map(industries)
+    else:
+        industry = pd.Series(np.nan, index=df.index, dtype=object)
+    values = df[sources].astype('float64').replace([np.inf, -np.inf], np.nan)
+    ranks = values.groupby([industry, df['年'], df[period_col]], dropna=True).rank(pct=True) * 100
+    ranks = ranks.reindex(df.index)
+    for col in sources:
+        df[col + PEER_RANK_SUFFIX] = ranks[col]
+    return df
+
+def metric_frame(df, period_col, industries=None):
+    """
+    計算 df 的指標與產業同業百分位，保留原始欄位 (供寫入指標表與產業彙總表)。
+    季報沒有產業別，以 industries (公司代號 → 產業別) 補上產業別欄位。
+    """
+    if period_col == '月':
+        return add_peer_ranks(calculate_monthly_metrics(df), '月')
+    result = calculate_quarterly_metrics(df)
+    if industries is not None and '產業別' not in result.columns:
+        result['產業別'] = result['公司代號'].map(industries)
+    return add_peer_ranks(result, '季')
+
+def metric_table_columns(period_col):
+    """指標表的欄位：鍵欄位 + 指標欄位 + 同業百分位欄位"""
+    if period_col == '月':
+        return ['公司代號', '年', '月'] + MONTHLY_METRIC_COLUMNS + MONTHLY_PEER_RANK_COLUMNS
+    return ['公司代號', '年', '季'] + QUARTERLY_METRIC_COLUMNS + QUARTERLY_PEER_RANK_COLUMNS
+
+def build_metric_frames(monthly_df, quarterly_df):
+    """
+    月營收與季報全部期間的指標與同業百分位 (保留原始欄位，見 metric_frame)。
+    季報沒有產業別，以月營收中各公司最新的產業別補上。
+    """
+    monthly = metric_frame(monthly_df, '月')
+    quarterly = metric_frame(quarterly_df, '季', latest_industries(monthly_df))
+    return monthly, quarterly
+
+def _cube_stats(values, groupings, edges):
+    """單一指標依 groupings 分組的統計量與分布 (CUBE_STAT_COLUMNS)"""
+    grouped = values.groupby(groupings)
+    stats = pd.DataFrame({
+        '家數': grouped.count(),
+        '總和': grouped.sum(min_count=1),
+        '平均': grouped.mean(),
+    })
+    quantiles = grouped.quantile(CUBE_QUANTILES).unstack()
+    for q, name in zip(CUBE_QUANTILES, CUBE_QUANTILE_COLUMNS):
+        stats[name] = quantiles[q]
+    stats['正值比例'] = (values > 0).astype('float64').where(values.notna()).groupby(groupings).mean()
+    # 分布：以 edges 切成 len(edges)+1 個區間，計算各區間的家數
+    valid = values.notna()
+    bins = pd.Series(np.digitize(values[valid], edges), index=values.index[valid])
+    counts = bins.groupby([g[valid] for g in groupings] + [bins]).size().unstack(fill_value=0)
+    counts = counts.reindex(index=stats.index, columns=range(len(edges) + 1), fill_value=0)
+    for i in range(len(edges) + 1):
+        stats[f'分布_{i + 1}'] = counts[i].to_numpy()
+    return stats
+
+@instrument()
+def industry_cube(frame, period_col):
+    """
+    產業 × 期間彙總表：frame 為含指標欄位與產業別的資料 (metric_frame 的結果)，
+    以 (產業別, 年, 月/季, 指標) 為鍵，彙總 CUBE_METRICS 各指標的 CUBE_STAT_COLUMNS。
+    另以 ALL_INDUSTRIES 列出全市場的彙總；沒有產業別的公司只計入全市場。
+    """
+    keys = ['產業別', '年', period_col]
+    columns = keys + CUBE_METRICS[period_col]
+    data = frame[[col for col in columns if col in frame.columns]].copy()
+    data['產業別'] = data['產業別'].astype(object) if '產業別' in data.columns else np.nan
+    market = data.assign(產業別=ALL_INDUSTRIES)
+    data = pd.concat([data.dropna(subset=['產業別']), market], ignore_index=True)
+    groupings = [data[key] for key in keys]
+    parts = []
+    for metric in CUBE_METRICS[period_col]:
+        if metric not in data.columns:
+            continue
+        values = data[metric].astype('float64').replace([np.inf, -np.inf], np.nan)
+        stats = _cube_stats(values, groupings, CUBE_HIST_EDGES[metric])
+        stats.insert(0, '指標', metric)
+        parts.append(stats)
+    if not parts:
+        return pd.DataFrame(columns=keys + ['指標'] + CUBE_STAT_COLUMNS)
+    cube = pd.concat(parts).reset_index()
+    return cube[keys + ['指標'] + CUBE_STAT_COLUMNS]
+
+def _growth_lags(period_col):
+    specs = MONTHLY_GROWTH_SPECS if period_col == '月' else QUARTERLY_GROWTH_SPECS
+    return sorted({lag for _, _, lag in specs})
+
+def affected_periods(new_periods, period_col):
+    """
+    新匯入 (或更正) 的期間會影響的指標期間：
+    該期間本身，以及以它為比較基準的後續期間 (往後 1、3、12 個月或 1、4 季)。
+    回傳排序後的 [(年, 月/季), ...]。
+    """
+    if not new_periods:
+        return []
+    years, periods = zip(*new_periods)
+    index = set(period_index(years, periods, period_col).tolist())
+    index |= {i + lag for i in index for lag in _growth_lags(period_col)}
+    return index_to_periods(sorted(index), period_col)
+
+def source_periods(periods, period_col):
+    """重算 periods 的指標所需讀取的期間：期間本身與其各項比較基準期"""
+    if not periods:
+        return []
+    years, values = zip(*periods)
+    index = set(period_index(years, values, period_col).tolist())
+    index |= {i - lag for i in index for lag in _growth_lags(period_col)}
+    return index_to_periods(sorted(index), period_col)
+
+def recompute_period_frame(df, periods, period_col, industries=None):
+    """
+    只保留 periods 期間、已計算指標與同業百分位的資料列 (保留原始欄位，見 metric_frame)。
+    df 須包含 source_periods(periods) 的所有公司、所有資料列，比較基準期才不會缺漏，
+    同業百分位與產業彙總也才是以完整的同期橫斷面計算。
+    """
+    result = metric_frame(df, period_col, industries)
+    if not periods:
+        return result.iloc[:0]
+    years, values = zip(*periods)
+    wanted = period_index(years, values, period_col)
+    mask = np.isin(period_index(result['年'], result[period_col], period_col), wanted)
+    return result[mask].reset_index(drop=True)
@@ -1,137 +1,184 @@
 # multi_company_analysis.py
 import streamlit as st
+import numpy as np
 import pandas as pd
 import plotly.express as px
+from data_access import data_version
+from companies import get_company_directory, company_multiselect
+from periods import get_period_view, period_range_selector
+from metrics import period_index, MONTHLY_METRIC_COLUMNS, QUARTERLY_METRIC_COLUMNS
+from charts import line_figure, heatmap_figure
+from pivots import get_metric_pivot
+from tables import paginated_table
+from instrumentation import instrument
 
-def multi_company_analysis(monthly_df, quarterly_df):
+def _values_at(view, period, value_col, codes):
+    """單一期間各公司的數值，依 codes 順序對齊 (缺資料為 NaN)"""
+    rows = view.slice(period, period).drop_duplicates("公司代號")
+    values = pd.Series(rows[value_col].to_numpy(dtype="float64", na_value=np.nan),
+                       index=rows["公司代號"].to_numpy())
+    return values.reindex(codes).to_numpy()
+
+@instrument()
+def compute_growth(view, company_codes, directory, start, end, value_col):
+    """
+    一次算出所有公司由 start 期到 end 期的增長率 (%)：
+    起訖兩期各取一個期間切片並依公司代號對齊，以單一陣列運算取代逐公司篩選。
+    任一期缺資料或起始值為 0 的公司不列入結果；公司名稱由公司目錄 (directory) 帶入。
+    """
+    codes = pd.unique(np.asarray(company_codes))
+    start_values = _values_at(view, start, value_col, codes)
+    end_values = _values_at(view, end, value_col, codes)
+    with np.errstate(divide="ignore", invalid="ignore"):
+        growth = (end_values - start_values) / start_values * 100
+    growth[start_values == 0] = np.nan
+    growth_df = pd.DataFrame({
+        "公司代號": codes,
+        "公司名稱": directory.names(codes.tolist()),
+        "增長率(%)": growth,
+    })
+    return growth_df.dropna(subset=["增長率(%)"])
+
+# 比較項目 → (資料表, 數值欄位, 起訖選單標籤)
+GROWTH_OPTIONS = {
+    "月度營收增長率": ("monthly_revenue", "營業收入-當月營收", ("起始期間 (年-月)", "結束期間 (年-月)")),
+    "資產增長率": ("quarterly_report", "資產總計(額)", ("起始季度 (年 Q季)", "結束季度 (年 Q季)")),
+}
+
+PERIOD_AXIS_TITLES = {"月": "年月", "季": "季期"}
+# 熱力圖可選的指標欄位與每頁公司數
+HEATMAP_COLUMNS = {"monthly_revenue": MONTHLY_METRIC_COLUMNS, "quarterly_report": QUARTERLY_METRIC_COLUMNS}
+HEATMAP_PAGE_SIZE = 50
+# 多公司走勢圖可選的欄位：資料表 → {顯示名稱: 欄位}
+TREND_COLUMNS = {
+    "monthly_revenue": {"營收": "營業收入-當月營收", "YoY (%)": "YoY"},
+    "quarterly_report": {"資產總計": "資產總計(額)", "YoY (%)": "YoY"},
+}
+
+@instrument()
+def company_series(view, company_codes, start, end, value_col):
+    """
+    start 到 end 期間各公司的 (期間索引, 數值) 序列，依公司代號排序：[(代號, 期間索引, 數值), ...]。
+    期間切片後依代號穩定排序一次，再以各公司的起點切開，不逐公司篩選。
+    """
+    rows = view.slice(start, end)
+    codes = rows["公司代號"].to_numpy(dtype="int64")
+    selected = np.isin(codes, np.asarray(company_codes, dtype="int64"))
+    order = np.flatnonzero(selected)[np.argsort(codes[selected], kind="stable")]
+    codes = codes[order]
+    periods = period_index(rows["年"], rows[view.period_col], view.period_col)[order]
+    values = rows[value_col].to_numpy(dtype="float64", na_value=np.nan)[order]
+    unique_codes, starts = np.unique(codes, return_index=True)
+    bounds = zip(starts, np.append(starts[1:], len(codes)))
+    return [(code, periods[lo:hi], values[lo:hi]) for code, (lo, hi) in zip(unique_codes.tolist(), bounds)]
+
+@instrument("頁面 多公司分析")
+def multi_company_analysis(data):
     st.header("多公司分析")
-    # 篩選模式：依產業別、全選、自訂
+    directory = get_company_directory(data_version())
+    # 篩選模式與比較項目決定表單內有哪些選單，因此放在表單外
     filter_mode = st.radio("選擇篩選模式", ("依產業別", "全選", "自訂"))
-    if filter_mode == "依產業別":
-        industries = sorted(monthly_df["產業別"].unique())
-        selected_industry = st.selectbox("選擇產業", industries)
-        companies_df = monthly_df[monthly_df["產業別"] == selected_industry][['公司代號', '公司名稱']].drop_duplicates().sort_values('公司代號')
-    elif filter_mode == "自訂":
-        companies_df = monthly_df[['公司代號', '公司名稱']].drop_duplicates().sort_values('公司代號')
-        companies_df['display'] = companies_df['公司代號'].astype(str) + " - " + companies_df['公司名稱']
-        selected = st.multiselect("選擇公司", companies_df['display'].tolist())
-        companies_df = companies_df[companies_df['display'].isin(selected)]
-    else:
-        companies_df = monthly_df[['公司代號', '公司名稱']].drop_duplicates().sort_values('公司代號')
+    metric_option = st.selectbox("選擇比較項目", tuple(GROWTH_OPTIONS))
+    table, value_col, range_labels = GROWTH_OPTIONS[metric_option]
+    view = get_period_view(data_version(), table, data)
+    if not len(view.periods):
+        st.error("無月度資料" if table == "monthly_revenue" else "無季度資料")
+        return
+    
+    # 產業 / 公司與起訖期間一起送出，調整選單時不重跑整頁
+    with st.form("multi_company_filters"):
+        if filter_mode == "依產業別":
+            selected_industry = st.selectbox("選擇產業", directory.industries)
+            company_codes = directory.codes_in_industry(selected_industry)
+        elif filter_mode == "自訂":
+            company_codes = company_multiselect(directory, "選擇公司")
+        else:
+            company_codes = directory.codes.tolist()
+        selected_range = period_range_selector(view, *range_labels)
+        st.form_submit_button("套用篩選")
+    if selected_range is None:
+        return
     
     if st.checkbox("是否顯示比較對象列表"):
-        st.dataframe(companies_df.reset_index(drop=True))
+        paginated_table(directory.table(company_codes), key="multi_company_list")
     
+    st.subheader(f"{metric_option}比較")
+    growth_df = compute_growth(view, company_codes, directory, *selected_range, value_col)
+    paginated_table(growth_df, key="multi_company_growth")
+    _growth_chart(growth_df, directory, f"{metric_option}比較")
+    _trend_chart(view, table, company_codes, directory, selected_range)
+    _heatmap(data, table, company_codes, directory, selected_range)
+
+@st.fragment
+def _growth_chart(growth_df, directory, title):
+    """繪圖用公司選擇與長條圖；選擇公司只重跑此區塊"""
     # 獨立的繪圖用公司選擇，預設為空
     st.subheader("繪圖用公司選擇")
-    all_companies = monthly_df[['公司代號', '公司名稱']].drop_duplicates().sort_values('公司代號')
-    all_companies['display'] = all_companies['公司代號'].astype(str) + " - " + all_companies['公司名稱']
-    plot_choices = st.multiselect("請選擇用於繪圖的公司 (最多15間)", all_companies['display'].tolist(), default=[])
-    if len(plot_choices) > 15:
+    plot_codes = company_multiselect(directory, "請選擇用於繪圖的公司 (最多15間)", default=[])
+    if len(plot_codes) > 15:
         st.error("繪圖公司數量不可超過15間")
         return
-    plot_codes = [int(x.split(" - ")[0]) for x in plot_choices]
-    
-    # 供計算用：所有符合篩選模式的公司
-    company_codes = companies_df["公司代號"].tolist()
-    
-    metric_option = st.selectbox("選擇比較項目", ("月度營收增長率", "資產增長率"))
-    
-    if metric_option == "月度營收增長率":
-        st.subheader("月度營收增長率比較")
-        df_filtered = monthly_df[monthly_df["公司代號"].isin(company_codes)]
-        df_filtered = df_filtered.sort_values(['年','月'])
-        available_periods = df_filtered[['年','月']].drop_duplicates().sort_values(['年','月'])
-        available_periods['period_str'] = available_periods['年'].astype(str) + '-' + available_periods['月'].astype(str)
-        period_list = available_periods['period_str'].tolist()
-        if not period_list:
-            st.error("無月度資料")
-            return
-        col1, col2 = st.columns(2)
-        start_period = col1.selectbox("起始期間 (年-月)", period_list, index=0)
-        end_period = col2.selectbox("結束期間 (年-月)", period_list, index=len(period_list)-1)
-        def period_to_tuple(p):
-            parts = p.split('-')
-            return (int(parts[0]), int(parts[1]))
-        if period_to_tuple(start_period) > period_to_tuple(end_period):
-            st.error("起始期間必須早於或等於結束期間")
-            return
-        start_tuple = period_to_tuple(start_period)
-        end_tuple = period_to_tuple(end_period)
-        
-        growth_results = []
-        for code in company_codes:
-            df_comp = df_filtered[df_filtered["公司代號"] == code]
-            row_start = df_comp[(df_comp["年"] == start_tuple[0]) & (df_comp["月"] == start_tuple[1])]
-            row_end = df_comp[(df_comp["年"] == end_tuple[0]) & (df_comp["月"] == end_tuple[1])]
-            if row_start.empty or row_end.empty:
-                growth = None
-            else:
-                rev_start = row_start["營業收入-當月營收"].values[0]
-                rev_end = row_end["營業收入-當月營收"].values[0]
-                if rev_start == 0:
-                    growth = None
-                else:
-                    growth = (rev_end - rev_start) / rev_start * 100
-            growth_results.append({"公司代號": code, 
-                                   "公司名稱": companies_df[companies_df["公司代號"]==code]["公司名稱"].values[0] if not companies_df[companies_df["公司代號"]==code].empty else "未知",
-                                   "增長率(%)": growth})
-        growth_df = pd.DataFrame(growth_results).dropna(subset=["增長率(%)"])
-        st.dataframe(growth_df.reset_index(drop=True))
-        
-        # 繪圖僅用自訂選擇的公司（若未選擇則顯示提示）
-        if plot_codes:
-            plot_df = growth_df[growth_df["公司代號"].isin(plot_codes)]
-            fig_growth = px.bar(plot_df, x="公司代號", y="增長率(%)", text="增長率(%)",
-                                title="月度營收增長率比較", labels={"公司代號": "公司代號", "增長率(%)": "增長率 (%)"})
-            st.plotly_chart(fig_growth, use_container_width=True)
-        else:
-            st.info("未選擇繪圖用公司")
-        
-    elif metric_option == "資產增長率":
-        st.subheader("資產增長率比較")
-        df_quarter = quarterly_df[quarterly_df["公司代號"].isin(company_codes)]
-        df_quarter = df_quarter.sort_values(['年','季'])
-        available_quarters = df_quarter[['年','季']].drop_duplicates().sort_values(['年','季'])
-        available_quarters['quarter_str'] = available_quarters['年'].astype(str) + " Q" + available_quarters['季'].astype(str)
-        quarter_list = available_quarters['quarter_str'].tolist()
-        if not quarter_list:
-            st.error("無季度資料")
-            return
-        col1, col2 = st.columns(2)
-        start_quarter = col1.selectbox("起始季度 (年 Q季)", quarter_list, index=0)
-        end_quarter = col2.selectbox("結束季度 (年 Q季)", quarter_list, index=len(quarter_list)-1)
-        def quarter_to_tuple(q):
-            parts = q.split(" Q")
-            return (int(parts[0]), int(parts[1]))
-        if quarter_to_tuple(start_quarter) > quarter_to_tuple(end_quarter):
-            st.error("起始季度必須早於或等於結束季度")
-            return
-        start_q_tuple = quarter_to_tuple(start_quarter)
-        end_q_tuple = quarter_to_tuple(end_quarter)
-        growth_results = []
-        for code in company_codes:
-            df_comp = df_quarter[df_quarter["公司代號"] == code]
-            row_start = df_comp[(df_comp["年"] == start_q_tuple[0]) & (df_comp["季"] == start_q_tuple[1])]
-            row_end = df_comp[(df_comp["年"] == end_q_tuple[0]) & (df_comp["季"] == end_q_tuple[1])]
-            if row_start.empty or row_end.empty:
-                growth = None
-            else:
-                asset_start = row_start["資產總計(額)"].values[0]
-                asset_end = row_end["資產總計(額)"].values[0]
-                if asset_start == 0:
-                    growth = None
-                else:
-                    growth = (asset_end - asset_start) / asset_start * 100
-            growth_results.append({"公司代號": code, 
-                                   "公司名稱": companies_df[companies_df["公司代號"]==code]["公司名稱"].values[0] if not companies_df[companies_df["公司代號"]==code].empty else "未知",
-                                   "增長率(%)": growth})
-        growth_df = pd.DataFrame(growth_results).dropna(subset=["增長率(%)"])
-        st.dataframe(growth_df.reset_index(drop=True))
-        if plot_codes:
-            plot_df = growth_df[growth_df["公司代號"].isin(plot_codes)]
-            fig_growth = px.bar(plot_df, x="公司代號", y="增長率(%)", text="增長率(%)",
-                                title="資產增長率比較", labels={"公司代號": "公司代號", "增長率(%)": "增長率 (%)"})
-            st.plotly_chart(fig_growth, use_container_width=True)
-        else:
-            st.info("未選擇繪圖用公司")
+    # 繪圖僅用自訂選擇的公司（若未選擇則顯示提示）
+    if plot_codes:
+        plot_df = growth_df[growth_df["公司代號"].isin(plot_codes)]
+        fig_growth = px.bar(plot_df, x="公司代號", y="增長率(%)", text="增長率(%)",
+                            title=title, labels={"公司代號": "公司代號", "增長率(%)": "增長率 (%)"})
+        st.plotly_chart(fig_growth, use_container_width=True)
+    else:
+        st.info("未選擇繪圖用公司")
+
+@st.fragment
+def _trend_chart(view, table, company_codes, directory, selected_range):
+    """
+    比較對象全部公司的走勢折線圖 (可達數百家)；由 line_figure 降採樣並以 WebGL 繪製。
+    縮放區間只重跑此區塊，區間內點數夠少時即為完整解析度。
+    """
+    st.subheader("多公司走勢")
+    columns = TREND_COLUMNS[table]
+    col1, col2 = st.columns(2)
+    column_name = col1.radio("走勢欄位", tuple(columns), horizontal=True)
+    start, end = selected_range
+    options = [p for p in view.periods.tolist() if start <= p <= end]
+    if len(options) > 1:
+        start, end = col2.select_slider("縮放區間", options, value=(options[0], options[-1]), format_func=view.label)
+    series = company_series(view, company_codes, start, end, columns[column_name])
+    if not series:
+        st.info("所選區間沒有資料")
+        return
+    series = [(directory.label(code), x, y) for code, x, y in series]
+    fig = line_figure(series, view.period_col, title=f"{column_name} 走勢 ({len(series)} 家公司)",
+                      xaxis_title=PERIOD_AXIS_TITLES[view.period_col], yaxis_title=column_name)
+    st.plotly_chart(fig, use_container_width=True)
+
+def heatmap_order(pivot, rows, directory, lo, hi):
+    """熱力圖的列順序：依產業別排序，同產業內依區間內最新一期數值由大到小 (缺值在後)"""
+    industries = np.array([directory.industry(code) or "" for code in pivot.codes[rows].tolist()])
+    _, industry_rank = np.unique(industries, return_inverse=True)
+    latest = pivot.latest(rows, lo, hi)
+    missing = np.isnan(latest)
+    return rows[np.lexsort((np.where(missing, 0, -latest), missing, industry_rank))]
+
+@st.fragment
+def _heatmap(data, table, company_codes, directory, selected_range):
+    """
+    比較對象的 公司 × 期間 指標熱力圖，資料來自快取的 MetricPivot。
+    公司依產業別與最新數值排序，每頁 HEATMAP_PAGE_SIZE 家，整頁為單一 Heatmap trace。
+    """
+    st.subheader("指標熱力圖")
+    col1, col2 = st.columns(2)
+    value_col = col1.selectbox("熱力圖指標", HEATMAP_COLUMNS[table])
+    pivot = get_metric_pivot(data_version(), table, value_col, data)
+    lo, hi = pivot.window(*selected_range)
+    rows = pivot.rows(company_codes)
+    if not len(rows) or hi <= lo:
+        st.info("所選區間沒有資料")
+        return
+    rows = heatmap_order(pivot, rows, directory, lo, hi)
+    pages = (len(rows) - 1) // HEATMAP_PAGE_SIZE + 1
+    page = col2.number_input(f"頁次 (共 {pages} 頁，每頁 {HEATMAP_PAGE_SIZE} 家)", min_value=1, max_value=pages, value=1)
+    rows = rows[(page - 1) * HEATMAP_PAGE_SIZE:page * HEATMAP_PAGE_SIZE]
+    codes = pivot.codes[rows].tolist()
+    labels = [f"{directory.industry(code) or '-'} | {directory.label(code)}" for code in codes]
+    fig = heatmap_figure(pivot.values[rows, lo:hi], labels, pivot.periods[lo:hi], pivot.period_col,
+                         title=f"{value_col} 熱力圖 (第 {page}/{pages} 頁)", colorbar_title=value_col)
+    st.plotly_chart(fig, use_container_width=True)
@@ -1,157 +1,166 @@
 # overall_sorting.py
 import streamlit as st
+import numpy as np
 import pandas as pd
+from data_access import data_version
+from companies import get_company_directory, company_multiselect
+from metrics import period_index, lag_positions, growth_from_positions
+from periods import get_period_view, period_range_selector
+from tables import paginated_table
+from scoring import NORMALIZATIONS, SCORE_COLUMNS, DEFAULT_WEIGHTS, weighted_scores
+from instrumentation import instrument
 
-def compute_previous_period(is_monthly, year, period_value, mode):
-    # is_monthly=True：period_value 為月份；False：為季度
-    if is_monthly:
-        if mode == "MOM":
-            if period_value == 1:
-                return year - 1, 12
-            else:
-                return year, period_value - 1
-        elif mode == "QOQ":
-            total = year * 12 + period_value
-            prev_total = total - 3
-            prev_year = prev_total // 12
-            prev_month = prev_total % 12
-            if prev_month == 0:
-                prev_month = 12
-                prev_year -= 1
-            return prev_year, prev_month
-        elif mode == "YOY":
-            return year - 1, period_value
-        else:
-            return None
-    else:
-        if mode in ["MOM", "QOQ"]:
-            if period_value == 1:
-                return year - 1, 4
-            else:
-                return year, period_value - 1
-        elif mode == "YOY":
-            return year - 1, period_value
-        else:
-            return None
+# 排序模式對應的比較期數：月資料 MOM/QOQ/YOY 為前 1/3/12 個月，季資料 MOM/QOQ 為前一季、YOY 為前 4 季
+SORT_LAGS = {
+    True: {"MOM": 1, "QOQ": 3, "YOY": 12},
+    False: {"MOM": 1, "QOQ": 1, "YOY": 4},
+}
+SORT_MODES = ("數值", "MOM", "QOQ", "YOY")
+# 數值欄位中不作為排序依據的鍵欄位
+KEY_COLUMNS = ("年", "月", "季", "公司代號")
+# 快取的排序值陣列數量上限 (資料來源 × 欄位 × 模式)；每筆為全市場長度的陣列
+SORT_CACHE_ENTRIES = 16
+
+def _row_keys(df, is_monthly):
+    """每列的 (公司代號, 期間索引) 組合鍵與期間索引，順序與 df 相同"""
+    period_col = "月" if is_monthly else "季"
+    index = period_index(df["年"], df[period_col], period_col)
+    return df["公司代號"].to_numpy(dtype="int64") * 1_000_000 + index, index
 
-def compute_sort_value(row, df_full, col, sort_mode, is_monthly):
+@instrument()
+def compute_sort_values(df_full, col, sort_mode, is_monthly):
+    """
+    一次算出所有列的排序值 (順序與 df_full 相同)：
+      - 數值：欄位本身
+      - MOM/QOQ/YOY：與同公司前 N 期比較的變化率 (%)，前期不存在或為 0 時為 NaN
+    以組合鍵排序後用 searchsorted 對齊前期，取代逐列篩選整個資料表。
+    """
+    values = df_full[col].to_numpy(dtype="float64", na_value=np.nan)
     if sort_mode == "數值":
-        return row[col]
-    else:
-        if is_monthly:
-            year = row['年']
-            month = row['月']
-            prev_year, prev_month = compute_previous_period(True, year, month, sort_mode)
-            df_prev = df_full[(df_full["公司代號"] == row["公司代號"]) & (df_full["年"] == prev_year) & (df_full["月"] == prev_month)]
-            if df_prev.empty:
-                return None
-            prev_value = df_prev.iloc[0][col]
-        else:
-            year = row['年']
-            quarter = row['季']
-            prev_year, prev_quarter = compute_previous_period(False, year, quarter, sort_mode)
-            df_prev = df_full[(df_full["公司代號"] == row["公司代號"]) & (df_full["年"] == prev_year) & (df_full["季"] == prev_quarter)]
-            if df_prev.empty:
-                return None
-            prev_value = df_prev.iloc[0][col]
-        if prev_value == 0 or prev_value is None:
-            return None
-        current_value = row[col]
-        return (current_value - prev_value) / prev_value * 100
+        return values
+    keys, _ = _row_keys(df_full, is_monthly)
+    order = np.argsort(keys, kind="stable")
+    positions = lag_positions(keys[order], SORT_LAGS[is_monthly][sort_mode])
+    growth = np.empty(len(values))
+    growth[order] = growth_from_positions(values[order], positions)
+    growth[~np.isfinite(growth)] = np.nan
+    return growth
+
+@st.cache_data(max_entries=SORT_CACHE_ENTRIES)
+def _sort_values(version, dataset, col, sort_mode, _view):
+    """
+    依 (資料版本, 資料來源, 欄位, 模式) 快取全部列的排序值 (順序與 _view.df 相同)。
+    排序值以全部期間計算 (前期可能在範圍之外)，與期間範圍無關，調整範圍時不需重算。
+    """
+    return compute_sort_values(_view.df, col, sort_mode, dataset == "月營收")
+
+def _sort_permutation(view, values, start, end):
+    """
+    期間範圍內的排序結果：以 searchsorted 切出範圍後排序，
+    回傳 (由大到小排列的列位置, 排序值為 NaN 的列位置)，列位置對應 view.df。
+    """
+    lo, hi = view.bounds(start, end)
+    in_range = values[lo:hi]
+    valid = np.flatnonzero(~np.isnan(in_range))
+    ranked = lo + valid[np.argsort(-in_range[valid], kind="stable")]
+    missing = lo + np.flatnonzero(np.isnan(in_range))
+    return ranked, missing
+
+@st.fragment
+def _show_sorted(view, filtered_codes, dataset, start, end):
+    """
+    排序條件選單與排序結果；排序值在全市場上計算並快取，排序期間範圍後再依所選公司篩選。
+    以 fragment 執行，調整排序條件只重跑此區塊。
+    """
+    df_full = view.df
+    numeric_cols = [c for c in df_full.columns
+                    if c not in KEY_COLUMNS and pd.api.types.is_numeric_dtype(df_full[c])]
+    col1, col2, col3, col4 = st.columns(4)
+    sort_col = col1.selectbox("排序欄位", numeric_cols)
+    sort_mode = col2.selectbox("排序方式", SORT_MODES)
+    descending = col3.checkbox("由大到小", value=True)
+    top_n = col4.number_input("顯示前 N 名 (0 為全部)", min_value=0, value=0, step=10)
 
-def overall_sorting(monthly_df, quarterly_df):
+    values = _sort_values(data_version(), dataset, sort_col, sort_mode, view)
+    ranked, missing = _sort_permutation(view, values, start, end)
+    order = ranked if descending else ranked[::-1]
+    order = np.concatenate([order, missing])
+    codes = df_full["公司代號"].to_numpy()
+    order = order[np.isin(codes[order], filtered_codes)]
+    if top_n:
+        order = order[:top_n]
+    # 只有目前頁面的資料列與所選欄位會送到瀏覽器
+    paginated_table(df_full, key=f"sorted_{dataset}", order=order,
+                    extra_columns={f"排序值 ({sort_mode})": values})
+
+@st.fragment
+def _show_scored(view, table, filtered_codes, start, end):
+    """
+    自訂權重的多指標綜合評分與排序。各指標先在每期內做橫斷面標準化，再依權重合成；
+    結果依權重向量快取，調整權重只重跑此區塊並重新加權。
+    """
+    method = st.selectbox("標準化方式", NORMALIZATIONS)
+    columns = [col for col in SCORE_COLUMNS[table] if col in view.df.columns]
+    defaults = DEFAULT_WEIGHTS[table]
+    weights = {}
+    slider_cols = st.columns(4)
+    for i, col in enumerate(columns):
+        weights[col] = slider_cols[i % 4].slider(col, -1.0, 1.0, defaults.get(col, 0.0), 0.1,
+                                                 key=f"weight_{table}_{col}")
+    if not any(weights.values()):
+        st.info("請至少設定一個不為 0 的權重")
+        return
+
+    scores = weighted_scores(data_version(), table, weights, method, view)
+    lo, hi = view.bounds(start, end)
+    in_range = scores[lo:hi]
+    valid = np.flatnonzero(~np.isnan(in_range))
+    order = lo + valid[np.argsort(-in_range[valid], kind="stable")]
+    codes = view.df["公司代號"].to_numpy()
+    order = order[np.isin(codes[order], filtered_codes)]
+    paginated_table(view.df, key=f"scored_{table}", order=order, extra_columns={"綜合評分": scores})
+
+# 資料來源 → (資料表, 篩選模式, 起訖選單標籤)
+DATASETS = {
+    "月營收": ("monthly_revenue", ("依產業別", "全選", "自訂"), ("起始期間 (年-月)", "結束期間 (年-月)")),
+    "季財報": ("quarterly_report", ("全選", "自訂"), ("起始季度 (年 Q季)", "結束季度 (年 Q季)")),
+}
+
+@instrument("頁面 整體排序")
+def overall_sorting(data):
     st.header("整體排序功能")
     st.info("請使用下方多選框選擇目前的公司（格式：公司代號 - 公司名稱），可輸入部分文字自動補全，並直接點選標籤右側的刪除按鈕。")
-    dataset_option = st.radio("選擇資料來源", ("月營收", "季財報"))
-    if dataset_option == "月營收":
-        is_monthly = True
-        df_full = monthly_df.copy()
-        filter_mode = st.selectbox("選擇篩選模式", ("依產業別", "全選", "自訂"))
-        if filter_mode == "依產業別":
-            industries = sorted(df_full["產業別"].unique())
-            selected_industry = st.selectbox("選擇產業", industries)
-            filtered_df = df_full[df_full["產業別"] == selected_industry]
-            filtered_codes = filtered_df["公司代號"].unique().tolist()
-        elif filter_mode == "自訂":
-            unique_companies = df_full[['公司代號', '公司名稱']].drop_duplicates().sort_values('公司代號')
-            unique_companies['display'] = unique_companies['公司代號'].astype(str) + " - " + unique_companies['公司名稱']
-            selected = st.multiselect("選擇公司", unique_companies['display'].tolist())
-            filtered_codes = [int(x.split(" - ")[0]) for x in selected]
-        else:
-            filtered_codes = df_full["公司代號"].unique().tolist()
-        
-        unique_companies = df_full[['公司代號', '公司名稱']].drop_duplicates().sort_values('公司代號')
-        unique_companies['display'] = unique_companies['公司代號'].astype(str) + " - " + unique_companies['公司名稱']
-        default_options = unique_companies[unique_companies["公司代號"].isin(filtered_codes)]["display"].tolist()
-        selected_companies = st.multiselect("目前選擇的公司", unique_companies['display'].tolist(), default=default_options)
-        try:
-            filtered_codes = [int(x.split(" - ")[0].strip()) for x in selected_companies if x.strip()]
-        except:
-            st.error("請確保輸入格式正確")
-        df_filtered = df_full[df_full["公司代號"].isin(filtered_codes)]
-        
-        df_full_sorted = df_full.sort_values(['年','月'])
-        available_periods = df_full_sorted[['年','月']].drop_duplicates()
-        available_periods['period_str'] = available_periods['年'].astype(str) + '-' + available_periods['月'].astype(str)
-        period_list = available_periods['period_str'].tolist()
-        if not period_list:
-            st.error("無月度資料")
-            return
-        col1, col2 = st.columns(2)
-        start_period = col1.selectbox("起始期間 (年-月)", period_list, index=0)
-        end_period = col2.selectbox("結束期間 (年-月)", period_list, index=len(period_list)-1)
-        def period_to_tuple(p):
-            parts = p.split('-')
-            return (int(parts[0]), int(parts[1]))
-        if period_to_tuple(start_period) > period_to_tuple(end_period):
-            st.error("起始期間必須早於或等於結束期間")
-            return
-        start_tuple = period_to_tuple(start_period)
-        end_tuple = period_to_tuple(end_period)
-        df_display = df_filtered[df_filtered.apply(lambda row: (row['年'], row['月']) >= start_tuple and (row['年'], row['月']) <= end_tuple, axis=1)].copy()
-        
-        st.write("排序結果 (月營收)")
-        st.dataframe(df_display)
+    dataset_option = st.radio("選擇資料來源", tuple(DATASETS))
+    table, filter_modes, range_labels = DATASETS[dataset_option]
+    directory = get_company_directory(data_version())
+    view = get_period_view(data_version(), table, data)
+    if not len(view.periods):
+        st.error("無月度資料" if table == "monthly_revenue" else "無季度資料")
+        return
+    # 選項只列出此資料來源中有資料的公司
+    dataset_codes = directory.subset(view.df["公司代號"].unique())
+    # 篩選模式與所選產業 / 公司決定表單內公司選單的預設值，因此放在表單外
+    # (表單內的選單送出前不會更新，放在表單內會使預設值與所選產業不一致)
+    filter_mode = st.selectbox("選擇篩選模式", filter_modes)
+    if filter_mode == "依產業別":
+        selected_industry = st.selectbox("選擇產業", directory.industries)
+        filtered_codes = directory.codes_in_industry(selected_industry)
+    elif filter_mode == "自訂":
+        filtered_codes = company_multiselect(directory, "選擇公司", codes=dataset_codes)
+    else:
+        filtered_codes = dataset_codes
+
+    # 目前選擇的公司與起訖期間一起送出，調整選單時不重跑整頁
+    with st.form("overall_sorting_filters"):
+        filtered_codes = company_multiselect(directory, "目前選擇的公司", codes=dataset_codes, default=filtered_codes)
+        selected_range = period_range_selector(view, *range_labels)
+        st.form_submit_button("套用篩選")
+    if selected_range is None:
+        return
+    
+    st.write(f"排序結果 ({dataset_option})")
+    basis = st.radio("排序依據", ("單一指標", "綜合評分"), horizontal=True)
+    if basis == "單一指標":
+        _show_sorted(view, filtered_codes, dataset_option, *selected_range)
     else:
-        is_monthly = False
-        df_full = quarterly_df.copy()
-        filter_mode = st.selectbox("選擇篩選模式", ("全選", "自訂"))
-        if filter_mode == "自訂":
-            unique_companies = df_full[['公司代號', '公司名稱']].drop_duplicates().sort_values('公司代號')
-            unique_companies['display'] = unique_companies['公司代號'].astype(str) + " - " + unique_companies['公司名稱']
-            selected = st.multiselect("選擇公司", unique_companies['display'].tolist())
-            filtered_codes = [int(x.split(" - ")[0]) for x in selected]
-        else:
-            filtered_codes = df_full["公司代號"].unique().tolist()
-        unique_companies = df_full[['公司代號', '公司名稱']].drop_duplicates().sort_values('公司代號')
-        unique_companies['display'] = unique_companies['公司代號'].astype(str) + " - " + unique_companies['公司名稱']
-        default_options = unique_companies[unique_companies["公司代號"].isin(filtered_codes)]["display"].tolist()
-        selected_companies = st.multiselect("目前選擇的公司", unique_companies['display'].tolist(), default=default_options)
-        try:
-            filtered_codes = [int(x.split(" - ")[0].strip()) for x in selected_companies if x.strip()]
-        except:
-            st.error("請確保輸入格式正確")
-        df_filtered = df_full[df_full["公司代號"].isin(filtered_codes)]
-        
-        df_full_sorted = df_full.sort_values(['年','季'])
-        available_quarters = df_full_sorted[['年','季']].drop_duplicates()
-        available_quarters['quarter_str'] = available_quarters['年'].astype(str) + " Q" + available_quarters['季'].astype(str)
-        quarter_list = available_quarters['quarter_str'].tolist()
-        if not quarter_list:
-            st.error("無季度資料")
-            return
-        col1, col2 = st.columns(2)
-        start_quarter = col1.selectbox("起始季度 (年 Q季)", quarter_list, index=0)
-        end_quarter = col2.selectbox("結束季度 (年 Q季)", quarter_list, index=len(quarter_list)-1)
-        def quarter_to_tuple(q):
-            parts = q.split(" Q")
-            return (int(parts[0]), int(parts[1]))
-        if quarter_to_tuple(start_quarter) > quarter_to_tuple(end_quarter):
-            st.error("起始季度必須早於或等於結束季度")
-            return
-        start_q_tuple = quarter_to_tuple(start_quarter)
-        end_q_tuple = quarter_to_tuple(end_quarter)
-        df_display = df_filtered[df_filtered.apply(lambda row: (row['年'], row['季']) >= start_q_tuple and (row['年'], row['季']) <= end_q_tuple, axis=1)].copy()
-        
-        st.write("排序結果 (季財報)")
-        st.dataframe(df_display)
+        _show_scored(view, table, filtered_codes, *selected_range)
@@ -0,0 +1,72 @@
+# periods.py
+import numpy as np
+import streamlit as st
+from data_access import PERIOD_COLUMN, TABLES
+from metrics import period_index, index_to_periods
+from instrumentation import instrument
+
+# 期間顯示格式：月資料 "113-5"、季資料 "113 Q2"
+PERIOD_FORMATS = {"月": "{}-{}", "季": "{} Q{}"}
+PERIOD_NAMES = {"月": "期間", "季": "季度"}
+
+
+def period_labels(index, period_col):
+    """整數期間索引 → 顯示字串"""
+    fmt = PERIOD_FORMATS[period_col]
+    return [fmt.format(year, period) for year, period in index_to_periods(index, period_col)]
+
+
+class PeriodView:
+    """
+    依整數期間索引 (年*12+月 或 年*4+季) 排序的資料。
+    建立時排序一次並整理出期間清單與顯示字串，
+    之後的期間範圍篩選為 searchsorted 切片，不需逐列比較。
+    """
+    def __init__(self, df, period_col):
+        keys = period_index(df["年"], df[period_col], period_col)
+        order = np.argsort(keys, kind="stable")
+        self.period_col = period_col
+        self.df = df.take(order)
+        self.keys = keys[order]
+        self.periods = np.unique(self.keys)
+        self._labels = dict(zip(self.periods.tolist(), period_labels(self.periods, period_col)))
+
+    def label(self, index):
+        return self._labels[index]
+
+    def bounds(self, start, end):
+        """[start, end] 期間範圍在 self.df 中的列位置 (lo, hi)"""
+        lo = np.searchsorted(self.keys, start, side="left")
+        hi = np.searchsorted(self.keys, end, side="right")
+        return int(lo), int(hi)
+
+    @instrument()
+    def slice(self, start, end):
+        """期間介於 start 與 end (含) 的資料列"""
+        lo, hi = self.bounds(start, end)
+        return self.df.iloc[lo:hi]
+
+
+@st.cache_resource(max_entries=len(TABLES))
+def get_period_view(version, table, _datasets):
+    """
+    依資料版本快取的 table 的 PeriodView，回傳的物件為共用實例，呼叫端不可修改其中的資料。
+    _datasets 為頁面的 data_access.Datasets，只有快取未命中時才會實際載入 table。
+    """
+    return PeriodView(_datasets[table], PERIOD_COLUMN[table])
+
+
+def period_range_selector(view, start_label, end_label):
+    """
+    起訖期間選單 (選項為整數期間索引，以 view 的顯示字串呈現)。
+    回傳 (start, end)；起始晚於結束時顯示錯誤並回傳 None。
+    """
+    options = view.periods.tolist()
+    col1, col2 = st.columns(2)
+    start = col1.selectbox(start_label, options, index=0, format_func=view.label)
+    end = col2.selectbox(end_label, options, index=len(options) - 1, format_func=view.label)
+    if start > end:
+        name = PERIOD_NAMES[view.period_col]
+        st.error(f"起始{name}必須早於或等於結束{name}")
+        return None
+    return start, end
@@ -0,0 +1,57 @@
+# pivots.py
+import numpy as np
+import streamlit as st
+from data_access import PERIOD_COLUMN
+from metrics import period_index
+
+# 快取的 MetricPivot 數量上限 (資料表 × 指標)；資料更新後舊版本會依最久未使用淘汰
+PIVOT_CACHE_ENTRIES = 8
+
+
+class MetricPivot:
+    """
+    公司 × 期間的指標矩陣 (float32，缺資料為 NaN)。
+    列依公司代號排序 (self.codes)，欄依期間索引排序 (self.periods)；
+    以 np.unique / searchsorted 算出每列資料的格子位置後一次填入，不使用 pandas pivot。
+    """
+    def __init__(self, df, period_col, value_col):
+        codes = df["公司代號"].to_numpy(dtype="int64")
+        periods = period_index(df["年"], df[period_col], period_col)
+        self.period_col = period_col
+        self.value_col = value_col
+        self.codes, rows = np.unique(codes, return_inverse=True)
+        self.periods, cols = np.unique(periods, return_inverse=True)
+        self.values = np.full((len(self.codes), len(self.periods)), np.nan, dtype="float32")
+        self.values[rows, cols] = df[value_col].to_numpy(dtype="float64", na_value=np.nan)
+
+    def window(self, start, end):
+        """期間介於 start 與 end (含) 的欄範圍 (lo, hi)"""
+        lo = np.searchsorted(self.periods, start, side="left")
+        hi = np.searchsorted(self.periods, end, side="right")
+        return int(lo), int(hi)
+
+    def rows(self, codes):
+        """codes 在矩陣中的列位置 (不在矩陣中的代號略過)"""
+        codes = np.asarray(codes, dtype="int64")
+        if not len(self.codes):
+            return np.array([], dtype="int64")
+        pos = np.minimum(np.searchsorted(self.codes, codes), len(self.codes) - 1)
+        return pos[self.codes[pos] == codes]
+
+    def latest(self, rows, lo, hi):
+        """各列在 [lo, hi) 欄內最後一個非缺值的數值，全為缺值時為 NaN"""
+        block = self.values[rows, lo:hi]
+        if block.shape[1] == 0:
+            return np.full(len(rows), np.nan)
+        last = np.where(np.isfinite(block), np.arange(block.shape[1]), -1).max(axis=1)
+        values = block[np.arange(len(rows)), np.maximum(last, 0)]
+        return np.where(last >= 0, values, np.nan)
+
+
+@st.cache_resource(max_entries=PIVOT_CACHE_ENTRIES)
+def get_metric_pivot(version, table, value_col, _datasets):
+    """
+    依資料版本快取的 table 中 value_col 欄位的 MetricPivot，各 session 共用同一實例。
+    _datasets 為頁面的 data_access.Datasets，只有快取未命中時才會實際載入 table。
+    """
+    return MetricPivot(_datasets[table], PERIOD_COLUMN[table], value_col)
@@ -0,0 +1,114 @@
+# scoring.py
+import numpy as np
+import pandas as pd
+import streamlit as st
+from metrics import period_index, QUARTERLY_METRIC_COLUMNS
+from instrumentation import instrument
+
+# 每期橫斷面標準化方式
+NORMALIZATIONS = ("z-score", "百分位", "縮尾 z-score")
+# 縮尾 z-score：先將每期數值截在此分位數範圍內，再計算 z-score
+WINSOR_LIMITS = (0.01, 0.99)
+
+# 可加權的指標欄位與預設權重 (負權重表示數值越小越好，例如負債比率)
+SCORE_COLUMNS = {
+    "monthly_revenue": ["營業收入-當月營收", "YoY", "MoM", "QOQ"],
+    "quarterly_report": QUARTERLY_METRIC_COLUMNS,
+}
+DEFAULT_WEIGHTS = {
+    "monthly_revenue": {"YoY": 1.0, "MoM": 0.5},
+    "quarterly_report": {"YoY": 0.5, "毛利率": 1.0, "流動比率": 0.5, "負債比率": -0.5, "EPS": 1.0},
+}
+
+
+def period_groups(df, period_col):
+    """每列所屬期間的群組編號 (0 ~ 期數-1) 與期數"""
+    index = period_index(df["年"], df[period_col], period_col)
+    periods, groups = np.unique(index, return_inverse=True)
+    return groups, len(periods)
+
+
+def _zscore(values, groups, n_groups):
+    """以 bincount 一次算出每期平均與標準差；缺值不計入，標準差為 0 的期間 z 為 0"""
+    finite = np.isfinite(values)
+    filled = np.where(finite, values, 0.0)
+    counts = np.bincount(groups, weights=finite, minlength=n_groups)
+    with np.errstate(divide="ignore", invalid="ignore"):
+        mean = np.bincount(groups, weights=filled, minlength=n_groups) / counts
+        diff = np.where(finite, values - mean[groups], 0.0)
+        std = np.sqrt(np.bincount(groups, weights=diff ** 2, minlength=n_groups) / counts)
+        z = np.where(std[groups] > 0, diff / std[groups], 0.0)
+    return np.where(finite, z, np.nan)
+
+
+def normalize(values, groups, n_groups, method):
+    """
+    每期 (groups 相同者) 的橫斷面標準化，所有期間一次計算：
+      - z-score：(x - 當期平均) / 當期標準差
+      - 百分位：當期排名百分位，換算到 -1 ~ 1 (中位數為 0)
+      - 縮尾 z-score：先截在當期 WINSOR_LIMITS 分位數之間再算 z-score
+    無窮大與缺值視為缺值，結果為 NaN。
+    """
+    values = np.asarray(values, dtype="float64")
+    values = np.where(np.isfinite(values), values, np.nan)
+    if method == "百分位":
+        pct = pd.Series(values).groupby(groups).rank(pct=True).to_numpy()
+        return (pct - 0.5) * 2
+    if method == "縮尾 z-score":
+        grouped = pd.Series(values).groupby(groups)
+        lower = grouped.quantile(WINSOR_LIMITS[0]).reindex(range(n_groups)).to_numpy()[groups]
+        upper = grouped.quantile(WINSOR_LIMITS[1]).reindex(range(n_groups)).to_numpy()[groups]
+        values = np.clip(values, lower, upper)
+    elif method != "z-score":
+        raise ValueError(f"未知的標準化方式: {method}")
+    return _zscore(values, groups, n_groups)
+
+
+@instrument()
+def combine(normalized, weights):
+    """
+    依權重合成綜合分數：Σ w·z / Σ|w|，只計入該列有數值的指標
+    (缺少部分指標的公司以其餘指標的加權平均計分)，全部缺值時為 NaN。
+      - normalized：{欄位: 標準化後的陣列}
+      - weights：{欄位: 權重}
+    """
+    numerator = denominator = 0.0
+    for col, weight in weights.items():
+        if not weight:
+            continue
+        z = normalized[col]
+        available = np.isfinite(z)
+        numerator = numerator + np.where(available, weight * z, 0.0)
+        denominator = denominator + np.where(available, abs(weight), 0.0)
+    with np.errstate(divide="ignore", invalid="ignore"):
+        return np.where(np.asarray(denominator) > 0, numerator / denominator, np.nan)
+
+
+@instrument()
+def composite_scores(df, period_col, weights, method="z-score"):
+    """
+    所有公司、所有期間的綜合分數 (順序與 df 相同)。
+    每個有權重的欄位做一次全表向量化的每期標準化，再加權合成。
+    """
+    groups, n_groups = period_groups(df, period_col)
+    normalized = {col: normalize(df[col].to_numpy(dtype="float64", na_value=np.nan), groups, n_groups, method)
+                  for col, weight in weights.items() if weight}
+    return combine(normalized, weights)
+
+
+@st.cache_data(max_entries=sum(map(len, SCORE_COLUMNS.values())) * len(NORMALIZATIONS))
+def normalized_column(version, table, column, method, _view):
+    """依 (資料版本, 資料表, 欄位, 標準化方式) 快取的標準化結果，順序與 _view.df 相同"""
+    groups, n_groups = period_groups(_view.df, _view.period_col)
+    values = _view.df[column].to_numpy(dtype="float64", na_value=np.nan)
+    return normalize(values, groups, n_groups, method)
+
+
+def weighted_scores(version, table, weights, method, view):
+    """
+    綜合分數 (順序與 view.df 相同)。各欄位的標準化結果由 normalized_column 快取，
+    調整權重時只需重新加權 (向量化加總，不另外快取每組權重的結果)。
+    """
+    normalized = {col: normalized_column(version, table, col, method, view)
+                  for col, weight in weights.items() if weight}
+    return combine(normalized, weights)
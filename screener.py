@@ -0,0 +1,131 @@
+# screener.py
+import numpy as np
+import pandas as pd
+import streamlit as st
+from data_access import TABLES, Datasets, data_version
+from companies import get_company_directory
+from metrics import period_index
+from periods import get_period_view
+from instrumentation import instrument
+
+# 可以作為篩選依據的公司屬性欄位
+FILTER_COLUMNS = ("產業別", "市場別")
+
+
+class Screener:
+    """
+    全市場單期排名 (Top-K)：資料依期間排序一次，每期的資料列為連續區段，
+    查詢時只取出該期的指標陣列，以 argpartition 選出前 K 名後再排序這 K 筆，
+    不需排序或複製整個資料表。
+      - view：月營收或季報資料 (含指標欄位) 的 PeriodView，直接沿用其已排序的資料，不另外複製
+      - company_info：公司代號與 產業別 / 市場別 對照 (例如 load_companies())，
+        df 沒有這些欄位時 (季報) 以此補上
+    """
+    def __init__(self, view, company_info=None):
+        self.view = view
+        self.period_col = view.period_col
+        self.df = view.df
+        self.periods = view.periods
+        self._starts = np.searchsorted(view.keys, self.periods, side="left")
+        self._ends = np.searchsorted(view.keys, self.periods, side="right")
+        self.codes = self.df["公司代號"].to_numpy(dtype="int64")
+        self.metrics = [c for c in self.df.columns
+                        if c not in ("年", "月", "季", "公司代號") and pd.api.types.is_numeric_dtype(self.df[c])]
+        self._arrays = {}
+        # 產業別 / 市場別 以整數代碼逐列儲存，篩選時只需比較整數
+        self._labels = {}
+        self._label_codes = {}
+        for col in FILTER_COLUMNS:
+            if col in self.df.columns:
+                values = self.df[col]
+            elif company_info is not None and col in company_info.columns:
+                mapping = company_info.drop_duplicates("公司代號").set_index("公司代號")[col]
+                values = pd.Series(self.codes).map(mapping)
+            else:
+                continue
+            codes, labels = pd.factorize(pd.Series(values).astype(object), sort=True)
+            self._labels[col] = [str(label) for label in labels]
+            self._label_codes[col] = codes
+
+    def options(self, col):
+        """產業別 / 市場別 的可選值"""
+        return self._labels.get(col, [])
+
+    def _values(self, metric):
+        if metric not in self._arrays:
+            if metric not in self.metrics:
+                raise ValueError(f"未知的指標欄位: {metric}")
+            self._arrays[metric] = self.df[metric].to_numpy(dtype="float64", na_value=np.nan)
+        return self._arrays[metric]
+
+    def _period_position(self, period):
+        """period 可為整數期間索引或 (年, 月/季)"""
+        if isinstance(period, (tuple, list)):
+            period = int(period_index([period[0]], [period[1]], self.period_col)[0])
+        pos = np.searchsorted(self.periods, period)
+        if pos >= len(self.periods) or self.periods[pos] != period:
+            raise ValueError(f"沒有 {period} 期的資料")
+        return pos
+
+    def _filter_mask(self, col, value, lo, hi):
+        if value is None:
+            return None
+        if col not in self._labels:
+            raise ValueError(f"資料沒有 {col} 欄位")
+        labels = self._labels[col]
+        if value not in labels:
+            return np.zeros(hi - lo, dtype=bool)
+        return self._label_codes[col][lo:hi] == labels.index(value)
+
+    def top_k_positions(self, metric, period, k=50, descending=True, industry=None, market=None):
+        """前 K 名在 self.df 中的列位置 (依排名順序)；指標為缺值的公司不列入"""
+        pos = self._period_position(period)
+        lo, hi = int(self._starts[pos]), int(self._ends[pos])
+        values = self._values(metric)[lo:hi]
+        mask = np.isfinite(values)
+        for col, value in (("產業別", industry), ("市場別", market)):
+            extra = self._filter_mask(col, value, lo, hi)
+            if extra is not None:
+                mask &= extra
+        candidates = np.flatnonzero(mask)
+        if k <= 0:
+            return candidates[:0] + lo
+        scores = -values[candidates] if descending else values[candidates]
+        if k < len(candidates):
+            part = np.argpartition(scores, k - 1)[:k]
+            candidates, scores = candidates[part], scores[part]
+        return lo + candidates[np.argsort(scores, kind="stable")]
+
+    @instrument()
+    def top_k(self, metric, period, k=50, descending=True, industry=None, market=None):
+        """
+        單一期間依 metric 排名的前 K 家公司 (descending=False 時為最小的 K 家)。
+          - period：整數期間索引或 (年, 月/季)
+          - industry / market：只列入該產業別 / 市場別的公司，None 表示不限
+        回傳 DataFrame：排名、公司代號、公司名稱 (若有)、年、月/季、metric。
+        """
+        rows = self.top_k_positions(metric, period, k, descending, industry, market)
+        columns = [c for c in ("公司代號", "公司名稱", "年", self.period_col) if c in self.df.columns]
+        result = self.df.iloc[rows][columns + [metric]].reset_index(drop=True)
+        result.insert(0, "排名", np.arange(1, len(result) + 1))
+        return result
+
+
+@st.cache_resource(max_entries=len(TABLES))
+def get_screener(version, table, _datasets):
+    """
+    依資料版本快取的 table 的 Screener，各 session 共用同一實例。
+    _datasets 為頁面的 data_access.Datasets，只有快取未命中時才會實際載入 table；
+    與 get_period_view 共用同一個 PeriodView；產業別 / 市場別 由公司目錄補上。
+    """
+    return Screener(get_period_view(version, table, _datasets), get_company_directory(version).frame)
+
+
+def screen(metric, period, k=50, descending=True, industry=None, market=None, table="monthly_revenue"):
+    """
+    Python API：單一期間依 metric 排名的前 K 家公司 (參數見 Screener.top_k)，例如
+      screen("YoY", (113, 5), k=50, industry="半導體業")
+      screen("負債比率", (113, 2), k=20, descending=False, table="quarterly_report")
+    """
+    screener = get_screener(data_version(), table, Datasets((table,)))
+    return screener.top_k(metric, period, k, descending, industry, market)
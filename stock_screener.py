@@ -0,0 +1,44 @@
+# stock_screener.py
+import time
+import streamlit as st
+from data_access import data_version
+from screener import get_screener, FILTER_COLUMNS
+from instrumentation import instrument
+
+# 資料來源 → 資料表
+SCREEN_TABLES = {"月營收": "monthly_revenue", "季財報": "quarterly_report"}
+
+@instrument("頁面 選股篩選")
+def stock_screener(data):
+    st.header("選股篩選 (Top-K)")
+    dataset_option = st.radio("選擇資料來源", tuple(SCREEN_TABLES), horizontal=True)
+    table = SCREEN_TABLES[dataset_option]
+    screener = get_screener(data_version(), table, data)
+    view = screener.view
+    if not len(screener.periods):
+        st.error("無月度資料" if table == "monthly_revenue" else "無季度資料")
+        return
+
+    # 所有條件一起送出，調整選單時不重跑整頁
+    with st.form("screener_filters"):
+        col1, col2 = st.columns(2)
+        metric = col1.selectbox("排名指標", screener.metrics)
+        periods = screener.periods.tolist()
+        period = col2.selectbox("期間", periods, index=len(periods) - 1, format_func=view.label)
+        filters = {}
+        for col, column in zip(FILTER_COLUMNS, st.columns(len(FILTER_COLUMNS))):
+            options = screener.options(col)
+            if options:
+                filters[col] = column.selectbox(col, [None] + options,
+                                                format_func=lambda x: "全部" if x is None else x)
+        col3, col4 = st.columns(2)
+        descending = col3.radio("方向", ("由大到小", "由小到大"), horizontal=True) == "由大到小"
+        k = col4.number_input("顯示前 K 名", min_value=1, max_value=1000, value=50, step=10)
+        st.form_submit_button("篩選")
+
+    start = time.perf_counter()
+    result = screener.top_k(metric, period, int(k), descending,
+                            industry=filters.get("產業別"), market=filters.get("市場別"))
+    elapsed = (time.perf_counter() - start) * 1000
+    st.caption(f"{view.label(period)} 共 {len(result)} 家，查詢耗時 {elapsed:.1f} ms")
+    st.dataframe(result)
@@ -0,0 +1,69 @@
+# tables.py
+import numpy as np
+import pandas as pd
+import streamlit as st
+
+PAGE_SIZES = (25, 50, 100, 200)
+# 以原始數字顯示 (不加千分位) 的鍵欄位
+PLAIN_COLUMNS = ("年", "月", "季", "公司代號")
+
+
+def number_formats(df):
+    """
+    數值欄位的顯示格式 (st.column_config)，只改變前端顯示，不把欄位轉成字串：
+    鍵欄位維持原樣，整數加千分位，小數顯示到小數點後兩位。
+    """
+    config = {}
+    for col in df.columns:
+        series = df[col]
+        if not pd.api.types.is_numeric_dtype(series) or pd.api.types.is_bool_dtype(series):
+            continue
+        if col in PLAIN_COLUMNS:
+            fmt = "plain"
+        elif pd.api.types.is_integer_dtype(series):
+            fmt = "localized"
+        else:
+            fmt = "%.2f"
+        config[col] = st.column_config.NumberColumn(col, format=fmt)
+    return config
+
+
+def sort_order(df, column, descending):
+    """依 column 排序的列位置，缺值排在最後"""
+    series = df[column].reset_index(drop=True)
+    return series.sort_values(ascending=not descending, na_position="last", kind="stable").index.to_numpy()
+
+
+def paginated_table(df, key, order=None, extra_columns=None, default_columns=None):
+    """
+    分頁表格：排序與切頁都在伺服器端完成，只把目前頁面、使用者選擇的欄位送到瀏覽器。
+      - order：已排好 (並篩選過) 的列位置 (例如快取的排序結果)；None 時提供排序欄位選單
+      - extra_columns：{欄位名稱: 與 df 列對齊的陣列}，顯示在最前面 (例如排序值)
+      - default_columns：預設顯示的欄位，None 表示全部
+    key 用來區分同一頁面上的多個表格。
+    """
+    extra_columns = extra_columns or {}
+    columns = list(df.columns)
+    col1, col2 = st.columns([3, 1])
+    shown = col1.multiselect("顯示欄位", columns, default=default_columns or columns, key=f"{key}_columns")
+    page_size = col2.selectbox("每頁筆數", PAGE_SIZES, key=f"{key}_page_size")
+
+    if order is None:
+        col3, col4 = st.columns([3, 1])
+        sort_column = col3.selectbox("表格排序", [None] + columns, key=f"{key}_sort",
+                                     format_func=lambda c: "不排序" if c is None else c)
+        descending = col4.checkbox("由大到小", value=True, key=f"{key}_descending")
+        order = np.arange(len(df)) if sort_column is None else sort_order(df, sort_column, descending)
+
+    total = len(order)
+    pages = max((total - 1) // page_size + 1, 1)
+    # 頁數改變 (篩選或每頁筆數改變) 時回到第一頁
+    page = st.number_input(f"頁次 (共 {pages} 頁)", min_value=1, max_value=pages, value=1,
+                           key=f"{key}_page_{pages}")
+    rows = order[(page - 1) * page_size:page * page_size]
+    page_df = df.iloc[rows][shown]
+    for i, (name, values) in enumerate(extra_columns.items()):
+        page_df.insert(i, name, np.asarray(values)[rows])
+    page_df = page_df.reset_index(drop=True)
+    st.caption(f"共 {total} 筆，顯示第 {(page - 1) * page_size + min(len(rows), 1)}–{(page - 1) * page_size + len(rows)} 筆")
+    st.dataframe(page_df, column_config=number_formats(page_df))